@@ -2,8 +2,27 @@
 Project: File differences
 '''
 
+import hashlib
+import io
+import itertools
+import mmap
+import os
+import time
+
 IDENTICAL = -1
 
+# Number of bytes compared at a time when skipping the identical
+# prefix of two files
+DIFF_BLOCK_SIZE = 1 << 16
+
+# Number of characters compared at a time when looking for the first
+# difference between two lines
+DIFF_CHUNK_SIZE = 1 << 12
+
+# Number of lines compared at a time when following a run of equal
+# lines in diff_hunks
+SNAKE_CHUNK = 32
+
 def singleline_diff(line1, line2):
     """
     Inputs:
@@ -22,39 +41,43 @@ def singleline_diff(line1, line2):
     len_line2 = len(line2)
     
     if len_line1 == len_line2:
-        if line1.split() == line2.split():
+        if line1 == line2 or line1.split() == line2.split():
             return IDENTICAL
+    # index at which the two lines (strings) are not equal, or the
+    # length of the shorter line if it is a prefix of the longer one
+    return first_difference(line1, line2)
+
+def first_difference(str1, str2, chunk_size=DIFF_CHUNK_SIZE):
+    """
+    Inputs:
+      str1       - first string
+      str2       - second string
+      chunk_size - number of characters to compare at a time
+    Output:
+      Returns the index of the first character where str1 and str2
+      differ, or the length of the shorter string if it is a prefix
+      of the other.
+
+      The strings are compared a chunk at a time with slice equality,
+      and only the first differing chunk is bisected, so long lines
+      are never walked one character at a time in Python.
+    """
+    length = min(len(str1), len(str2))
+    start = 0
+    while start < length and str1[start:start + chunk_size] == str2[start:start + chunk_size]:
+        start += chunk_size
+    if start >= length:
+        return length
+    # str1[:low] == str2[:low] and the first difference is before high
+    low, high = start, min(start + chunk_size, length)
+    while low < high:
+        middle = (low + high) // 2
+        if str1[low:middle + 1] == str2[low:middle + 1]:
+            low = middle + 1
         else:
-            for index_break, (c_line1, c_line2) in enumerate(zip(line1, line2)):
-                if c_line1 == c_line2:
-                    pass
-                else:
-                    # index at which the two lines (strings) are not equal
-                    index = index_break
-                    # break the loop as we just need the first index at which it is not equal
-                    break
-            return index
-        
-    elif len_line1 != len_line2:
-        min_len = min(len_line1, len_line2)
-        
-        u_str_line1 = line1[:min_len]
-        u_str_line2 = line2[:min_len]
-        
-        if u_str_line1 == u_str_line2:
-            return min_len
-        else:
-            for index_break, (c_u_line1, c_u_line2) in enumerate(zip(u_str_line1, u_str_line2)):
-                if c_u_line1 == c_u_line2:
-                    pass
-                else:
-                    index = index_break
-                    break
-            return index
-    
-    else:
-        pass
-    
+            high = middle
+    return low
+
 def singleline_diff_format(line1, line2, idx):
     """
     Inputs:
@@ -128,19 +151,168 @@ def multiline_diff(lines1, lines2):
       and lines2 occurs.
 
       Returns (IDENTICAL, IDENTICAL) if the two lists are the same.
+
+      If one list is a prefix of the other, the first difference is at
+      index 0 of the line after the end of the shorter list.  This is
+      where the first hunk from diff_hunks starts, found without running
+      the full diff.
     """
     if lines1 == lines2:
         return (IDENTICAL, IDENTICAL)
-    elif len(lines1) != len(lines2):
-        return (max(len(lines1),len(lines2))-1,0)
-    else:
-        for line_index, (line1, line2) in enumerate(zip(lines1, lines2)):
-            idx = singleline_diff(line1, line2)
-            if idx != -1:
-                break
+    for line_index, (line1, line2) in enumerate(zip(lines1, lines2)):
+        idx = singleline_diff(line1, line2)
+        if idx != IDENTICAL:
+            return (line_index, idx)
+    if len(lines1) != len(lines2):
+        return (min(len(lines1), len(lines2)), 0)
+    return (IDENTICAL, IDENTICAL)
+
+def diff_hunks(lines1, lines2, max_edits=None):
+    """
+    Inputs:
+      lines1    - list of single line strings
+      lines2    - list of single line strings
+      max_edits - largest number of inserted plus deleted lines to
+                  look for, or None for no limit
+    Output:
+      Returns a list of hunks (start1, end1, start2, end2), in order,
+      meaning lines1[start1:end1] is replaced by lines2[start2:end2].
+      Lines outside the hunks are the same in both lists.  The hunks
+      make up a shortest edit script between the two lists.
+
+      Returns None as soon as it is known that more than max_edits
+      lines have to be inserted or deleted.
+    Action:
+      Uses Myers' O(ND) algorithm in its linear-space form: each range
+      is split at the middle snake found by middle_snake, and the two
+      halves are diffed in turn.
+    """
+    # Skip the common prefix with slice compares
+    prefix = first_difference(lines1, lines2)
+    seq1 = lines1[prefix:]
+    seq2 = lines2[prefix:]
+
+    hunks = []
+    ranges = [(0, len(seq1), 0, len(seq2))]
+    top_level = True
+    while ranges:
+        lo1, hi1, lo2, hi2 = ranges.pop()
+        while lo1 < hi1 and lo2 < hi2 and seq1[lo1] == seq2[lo2]:
+            lo1 += 1
+            lo2 += 1
+        while lo1 < hi1 and lo2 < hi2 and seq1[hi1 - 1] == seq2[hi2 - 1]:
+            hi1 -= 1
+            hi2 -= 1
+        if lo1 == hi1 or lo2 == hi2:
+            if top_level and max_edits is not None and hi1 - lo1 + hi2 - lo2 > max_edits:
+                return None
+            if lo1 < hi1 or lo2 < hi2:
+                if hunks and hunks[-1][1] == lo1 + prefix and hunks[-1][3] == lo2 + prefix:
+                    start1, _, start2, _ = hunks.pop()
+                    hunks.append((start1, hi1 + prefix, start2, hi2 + prefix))
+                else:
+                    hunks.append((lo1 + prefix, hi1 + prefix, lo2 + prefix, hi2 + prefix))
+        else:
+            # The edits in the two halves add up to those of the whole
+            # range, so the limit only has to be checked once
+            split = middle_snake(seq1, lo1, hi1, seq2, lo2, hi2,
+                                 max_edits if top_level else None)
+            if split is None:
+                return None
+            mid1, mid2 = split
+            ranges.append((mid1, hi1, mid2, hi2))
+            ranges.append((lo1, mid1, lo2, mid2))
+        top_level = False
+    return hunks
+
+def middle_snake(seq1, lo1, hi1, seq2, lo2, hi2, max_edits=None):
+    """
+    Inputs:
+      seq1      - first sequence
+      lo1, hi1  - range of seq1 to compare
+      seq2      - second sequence
+      lo2, hi2  - range of seq2 to compare
+      max_edits - largest edit distance to look for, or None
+    Output:
+      Returns a tuple (mid1, mid2) of positions in seq1 and seq2 where
+      a shortest edit script for the two ranges can be split in two.
+      The forward and backward searches of Myers' algorithm run in
+      turn until their furthest reaching paths overlap.
+
+      Returns None if the edit distance is more than max_edits.
+    """
+    len1 = hi1 - lo1
+    len2 = hi2 - lo2
+    max_d = (len1 + len2 + 1) // 2
+    v_offset = max_d
+    v_length = 2 * max_d + 2
+    # Furthest x reached on each diagonal, forwards and backwards
+    forward = [-1] * v_length
+    backward = [-1] * v_length
+    forward[v_offset + 1] = 0
+    backward[v_offset + 1] = 0
+    delta = len1 - len2
+    odd_delta = delta % 2 != 0
+    # Diagonals that have run off the edges are not searched again
+    k1start = k1end = k2start = k2end = 0
+    for d in range(max_d):
+        if max_edits is not None and 2 * d - 1 > max_edits:
+            return None
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            k1_offset = v_offset + k1
+            if k1 == -d or (k1 != d and forward[k1_offset - 1] < forward[k1_offset + 1]):
+                x1 = forward[k1_offset + 1]
             else:
-                pass
-        return (line_index, idx)
+                x1 = forward[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < len1 and y1 < len2 and seq1[lo1 + x1] == seq2[lo2 + y1]:
+                x1 += 1
+                y1 += 1
+                while (x1 + SNAKE_CHUNK <= len1 and y1 + SNAKE_CHUNK <= len2 and
+                       seq1[lo1 + x1:lo1 + x1 + SNAKE_CHUNK] == seq2[lo2 + y1:lo2 + y1 + SNAKE_CHUNK]):
+                    x1 += SNAKE_CHUNK
+                    y1 += SNAKE_CHUNK
+            forward[k1_offset] = x1
+            if x1 > len1:
+                k1end += 2
+            elif y1 > len2:
+                k1start += 2
+            elif odd_delta:
+                k2_offset = v_offset + delta - k1
+                if 0 <= k2_offset < v_length and backward[k2_offset] != -1:
+                    if x1 >= len1 - backward[k2_offset]:
+                        return (lo1 + x1, lo2 + y1)
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            k2_offset = v_offset + k2
+            if k2 == -d or (k2 != d and backward[k2_offset - 1] < backward[k2_offset + 1]):
+                x2 = backward[k2_offset + 1]
+            else:
+                x2 = backward[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < len1 and y2 < len2 and seq1[hi1 - x2 - 1] == seq2[hi2 - y2 - 1]:
+                x2 += 1
+                y2 += 1
+                while (x2 + SNAKE_CHUNK <= len1 and y2 + SNAKE_CHUNK <= len2 and
+                       seq1[hi1 - x2 - SNAKE_CHUNK:hi1 - x2] == seq2[hi2 - y2 - SNAKE_CHUNK:hi2 - y2]):
+                    x2 += SNAKE_CHUNK
+                    y2 += SNAKE_CHUNK
+            backward[k2_offset] = x2
+            if x2 > len1:
+                k2end += 2
+            elif y2 > len2:
+                k2start += 2
+            elif not odd_delta:
+                k1_offset = v_offset + delta - k2
+                if 0 <= k1_offset < v_length and forward[k1_offset] != -1:
+                    x1 = forward[k1_offset]
+                    if x1 >= len1 - x2:
+                        if max_edits is not None and 2 * d > max_edits:
+                            return None
+                        return (lo1 + x1, lo2 + x1 - k1_offset + v_offset)
+    # No common lines at all
+    if max_edits is not None and len1 + len2 > max_edits:
+        return None
+    return (hi1, lo2)
 
 def get_file_lines(filename):
     """
@@ -155,10 +327,9 @@ def get_file_lines(filename):
       behavior of this function is undefined.
     """
     lines_list = []
-    file_handle = open(filename, 'r')
-    file_content = file_handle.readlines()
-    for lines in file_content:
-        lines_list.append(lines.strip())
+    with open(filename, 'r') as file_handle:
+        for lines in file_handle:
+            lines_list.append(lines.strip())
     return lines_list
 
 def file_diff_format(filename1, filename2):
@@ -182,11 +353,195 @@ def file_diff_format(filename1, filename2):
     if file1_lines == file2_lines:
         return 'No differences\n'
     else:
-        for index_l, (line1, line2) in enumerate(zip(file1_lines, file2_lines)):
-            l_num = multiline_diff(file1_lines, file2_lines)[0]
-            diff_index = multiline_diff(file1_lines, file2_lines)[1]
-            str_diff = singleline_diff_format(file1_lines[l_num], file2_lines[l_num], diff_index)
-            formatted_str = 'Line '+str(l_num)+':\n'+str_diff
+        l_num, diff_index = multiline_diff(file1_lines, file2_lines)
+        if l_num == IDENTICAL:
+            return 'No differences\n'
+        line1 = file1_lines[l_num] if l_num < len(file1_lines) else ''
+        line2 = file2_lines[l_num] if l_num < len(file2_lines) else ''
+        str_diff = singleline_diff_format(line1, line2, diff_index)
+        formatted_str = 'Line '+str(l_num)+':\n'+str_diff
         return formatted_str
-    
 
+def file_diff_format_stream(filename1, filename2):
+    """
+    Inputs:
+      filename1 - name of first file
+      filename2 - name of second file
+    Output:
+      Same as file_diff_format, but the files are read in lock-step,
+      one line at a time, and reading stops at the first difference.
+      Memory use does not depend on the size of the files, and both
+      files are closed before returning.
+
+      If one file ends before the other, the first difference is at
+      index 0 of the line after the end of the shorter file.
+    """
+    with open(filename1, 'r') as file1, open(filename2, 'r') as file2:
+        return lines_diff_format(file1, file2, 0)
+
+def lines_diff_format(lines1, lines2, first_line):
+    """
+    Inputs:
+      lines1     - iterable of lines from the first file
+      lines2     - iterable of lines from the second file
+      first_line - line number of the first line in lines1 and lines2
+    Output:
+      Returns the file_diff_format string for the first difference
+      between lines1 and lines2, reading only up to that difference.
+      Lines are compared after stripping them, as in get_file_lines.
+    """
+    for l_num, (line1, line2) in enumerate(itertools.zip_longest(lines1, lines2), first_line):
+        if line1 is None or line2 is None:
+            line1 = '' if line1 is None else line1.strip()
+            line2 = '' if line2 is None else line2.strip()
+            diff_index = 0
+        else:
+            line1 = line1.strip()
+            line2 = line2.strip()
+            diff_index = singleline_diff(line1, line2)
+        if diff_index != IDENTICAL:
+            str_diff = singleline_diff_format(line1, line2, diff_index)
+            return 'Line '+str(l_num)+':\n'+str_diff
+    return 'No differences\n'
+
+def common_prefix(filename1, filename2, block_size=DIFF_BLOCK_SIZE):
+    """
+    Inputs:
+      filename1  - name of first file
+      filename2  - name of second file
+      block_size - number of bytes to compare at a time
+    Output:
+      Returns a tuple containing the byte offset where the line holding
+      the first differing byte starts, and the number of that line
+      (starting from 0).  Both files are memory-mapped and compared a
+      block at a time; only the first differing block is searched
+      further.  Line numbers count '\n' characters, so they assume
+      '\n' or '\r\n' line endings.
+    """
+    with open(filename1, 'rb') as file1, open(filename2, 'rb') as file2:
+        limit = min(os.fstat(file1.fileno()).st_size, os.fstat(file2.fileno()).st_size)
+        if limit == 0:
+            return (0, 0)
+        with mmap.mmap(file1.fileno(), 0, access=mmap.ACCESS_READ) as map1, \
+             mmap.mmap(file2.fileno(), 0, access=mmap.ACCESS_READ) as map2:
+            offset = 0
+            newlines = 0
+            # Slicing an mmap gives bytes, which compare with memcmp
+            while offset < limit:
+                block = map1[offset:offset + block_size]
+                if block != map2[offset:offset + block_size]:
+                    break
+                newlines += block.count(b'\n')
+                offset += len(block)
+            # Bisect the differing block down to the first differing byte
+            low, high = offset, min(offset + block_size, limit)
+            while low < high:
+                middle = (low + high + 1) // 2
+                if map1[offset:middle] == map2[offset:middle]:
+                    low = middle
+                else:
+                    high = middle - 1
+            newlines += map1[offset:low].count(b'\n')
+            return (map1.rfind(b'\n', 0, low) + 1, newlines)
+
+def file_diff_format_mmap(filename1, filename2, block_size=DIFF_BLOCK_SIZE):
+    """
+    Inputs:
+      filename1  - name of first file
+      filename2  - name of second file
+      block_size - number of bytes to compare at a time
+    Output:
+      Same as file_diff_format_stream, but the identical prefix of the
+      two files is skipped with common_prefix first.  Only the lines
+      from the first difference on are decoded and compared.
+    """
+    line_start, first_line = common_prefix(filename1, filename2, block_size)
+    with open(filename1, 'rb') as file1, open(filename2, 'rb') as file2:
+        file1.seek(line_start)
+        file2.seek(line_start)
+        return lines_diff_format(io.TextIOWrapper(file1), io.TextIOWrapper(file2), first_line)
+
+class DiffBaseline:
+    """
+    Reference file that many candidate files are diffed against.  The
+    digest of the file and the hash of each of its lines are computed
+    once, so each diff only has to hash the candidate.
+    """
+
+    def __init__(self, filename):
+        """
+        Inputs:
+          filename - name of the reference file
+        Action:
+          Reads the file and stores its lines, the hash of each line
+          and the digest of the whole file.
+        """
+        self.filename = filename
+        data, self.digest = read_file_digest(filename)
+        self.lines = bytes_to_lines(data)
+        self.line_hashes = [hash(line) for line in self.lines]
+
+    def diff(self, filename):
+        """
+        Inputs:
+          filename - name of the candidate file
+        Output:
+          Same as file_diff_format(self.filename, filename).  If the
+          two files have the same bytes, "No differences\n" is returned
+          without splitting the candidate into lines.  Otherwise the
+          line hashes are compared, and only lines whose hashes differ
+          are compared as strings.
+        """
+        data, digest = read_file_digest(filename)
+        if digest == self.digest:
+            return 'No differences\n'
+        lines = bytes_to_lines(data)
+        line_hashes = [hash(line) for line in lines]
+        min_len = min(len(lines), len(self.lines))
+        l_num = first_difference(self.line_hashes, line_hashes)
+        while l_num < min_len:
+            diff_index = singleline_diff(self.lines[l_num], lines[l_num])
+            if diff_index != IDENTICAL:
+                str_diff = singleline_diff_format(self.lines[l_num], lines[l_num], diff_index)
+                return 'Line '+str(l_num)+':\n'+str_diff
+            # The lines only differ in whitespace between words
+            l_num += 1 + first_difference(self.line_hashes[l_num + 1:], line_hashes[l_num + 1:])
+        if len(lines) == len(self.lines):
+            return 'No differences\n'
+        line1 = self.lines[l_num] if l_num < len(self.lines) else ''
+        line2 = lines[l_num] if l_num < len(lines) else ''
+        return 'Line '+str(l_num)+':\n'+singleline_diff_format(line1, line2, 0)
+
+def read_file_digest(filename):
+    """
+    Inputs:
+      filename - name of file to read
+    Output:
+      Returns a tuple containing the bytes of the file and their
+      BLAKE2 digest.
+    """
+    with open(filename, 'rb') as file_handle:
+        data = file_handle.read()
+    return (data, hashlib.blake2b(data).digest())
+
+def bytes_to_lines(data):
+    """
+    Inputs:
+      data - bytes read from a file
+    Output:
+      Returns the list of lines that get_file_lines would return for
+      a file holding data.
+    """
+    return [line.strip() for line in io.TextIOWrapper(io.BytesIO(data))]
+
+def time_file_diff(filename1, filename2):
+    """
+    Time file_diff_format, file_diff_format_stream and
+    file_diff_format_mmap on the two files and print the results.
+    """
+    for diff_function in (file_diff_format, file_diff_format_stream, file_diff_format_mmap):
+        start = time.perf_counter()
+        result = diff_function(filename1, filename2)
+        elapsed = time.perf_counter() - start
+        print(diff_function.__name__+': {:.4f}s'.format(elapsed))
+    print(result)
@@ -7,6 +7,87 @@ about the expected behavior of the program.
 """
 
 import csv
+import io
+import marshal
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+# Set CSV_CACHE to False to always parse the CSV text
+CSV_CACHE = True
+CSV_CACHE_SUFFIX = '.cache'
+CSV_CACHE_MAGIC = b'CSVCACH1'
+CSV_CACHE_HEADER = struct.Struct('<8sQQ')
+
+
+def read_csv_rows_cached(filename, separator, quote):
+    """
+    Inputs:
+      filename  - name of CSV file
+      separator - character that separates fields
+      quote     - character used to optionally quote fields
+    Output:
+      Returns a list of rows, starting with the header row, where
+      each row is a list of field values.  Blank lines are skipped.
+
+      The first call saves the rows to filename + CSV_CACHE_SUFFIX in
+      marshal format.  Later calls load them from there instead of
+      parsing the CSV text, as long as the CSV file's size and
+      modification time have not changed.
+    """
+    stat = os.stat(filename)
+    key = (CSV_CACHE_MAGIC, stat.st_size, stat.st_mtime_ns)
+    cachefile = filename + CSV_CACHE_SUFFIX
+    if CSV_CACHE:
+        try:
+            with open(cachefile, mode='rb') as cache:
+                if CSV_CACHE_HEADER.unpack(cache.read(CSV_CACHE_HEADER.size)) == key:
+                    cached_separator, cached_quote, rows = marshal.loads(cache.read())
+                    if (cached_separator, cached_quote) == (separator, quote):
+                        return rows
+        except (OSError, ValueError, EOFError, TypeError, struct.error):
+            pass
+
+    with open(filename, mode='r', newline='') as csvfile:
+        csv_reader = csv.reader(csvfile, delimiter=separator, quotechar=quote)
+        # Share repeated values, so the cache stores each of them once
+        values = dict()
+        rows = [[values.setdefault(value, value) for value in row] for row in csv_reader if row]
+    if CSV_CACHE:
+        try:
+            with open(cachefile + '.tmp', mode='wb') as cache:
+                cache.write(CSV_CACHE_HEADER.pack(*key))
+                cache.write(marshal.dumps((separator, quote, rows)))
+            os.replace(cachefile + '.tmp', cachefile)
+        except OSError:
+            pass
+    return rows
+
+
+def csv_rows_as_dicts(rows):
+    """
+    Inputs:
+      rows - list of rows from read_csv_rows_cached
+    Output:
+      Returns a list of dictionaries mapping the field names in the
+      header row to the field values of each following row, exactly
+      as csv.DictReader would.
+    """
+    if not rows:
+        return []
+    fieldnames = rows[0]
+    numfields = len(fieldnames)
+    dicts = []
+    for row in rows[1:]:
+        row_dict = dict(zip(fieldnames, row))
+        if len(row) > numfields:
+            row_dict[None] = row[numfields:]
+        else:
+            for key in fieldnames[len(row):]:
+                row_dict[key] = None
+        dicts.append(row_dict)
+    return dicts
+
 
 def read_csv_fieldnames(filename, separator, quote):
     """
@@ -34,12 +115,8 @@ def read_csv_as_list_dict(filename, separator, quote):
       corresponds to a row in the CSV file.  The dictionaries in the
       list map the field names to the field values for that row.
     """
-    row_list = list()
-    with open(filename, mode='r', newline='') as csvfile:
-        csv_reader = csv.DictReader(csvfile,delimiter=separator,quotechar=quote)
-        for row in csv_reader:
-            row_list.append(row)
-    return row_list
+    rows = read_csv_rows_cached(filename, separator, quote)
+    return csv_rows_as_dicts(rows)
 
 
 def read_csv_as_nested_dict(filename, keyfield, separator, quote):
@@ -55,14 +132,138 @@ def read_csv_as_nested_dict(filename, keyfield, separator, quote):
       CSV file.  The inner dictionaries map the field names to the
       field values for that row.
     """
+    rows = read_csv_rows_cached(filename, separator, quote)
     row_dict = dict()
-    with open(filename, mode='r', newline='') as csvfile:
-        csv_reader = csv.DictReader(csvfile,delimiter=separator,quotechar=quote)
-        for row in csv_reader:
-            row_dict[row[keyfield]] = row
+    for row in csv_rows_as_dicts(rows):
+        row_dict[row[keyfield]] = row
     return row_dict
 
 
+def next_record_start(data, position, quote):
+    """
+    Inputs:
+      data     - bytes of a CSV file
+      position - byte offset to start searching from
+      quote    - quote character as bytes
+    Output:
+      Returns the offset just past the first newline at or after
+      position that is not inside a quoted field, or len(data) if
+      there is no such newline.
+    """
+    quotes = data.count(quote, 0, position)
+    while True:
+        newline = data.find(b'\n', position)
+        if newline == -1:
+            return len(data)
+        quotes += data.count(quote, position, newline)
+        # An even number of quote characters means we are outside a
+        # quoted field (escaped quotes are doubled, so they pair up)
+        if quotes % 2 == 0:
+            return newline + 1
+        position = newline + 1
+
+
+def split_csv_records(filename, quote, numchunks):
+    """
+    Inputs:
+      filename  - name of CSV file
+      quote     - character used to optionally quote fields
+      numchunks - number of chunks to split the records into
+    Output:
+      Returns a list of byte offsets.  The first offset is the end of
+      the header row, the last is the end of the file, and consecutive
+      offsets delimit chunks that each hold whole records.
+    """
+    with open(filename, mode='rb') as csvfile:
+        data = csvfile.read()
+    quote = quote.encode()
+    boundaries = [next_record_start(data, 0, quote)]
+    chunk_size = max(1, (len(data) - boundaries[0]) // numchunks)
+    while boundaries[-1] < len(data):
+        boundaries.append(next_record_start(data, boundaries[-1] + chunk_size - 1, quote))
+    return boundaries
+
+
+def decode_csv_bytes(data):
+    """
+    Inputs:
+      data - bytes read from a CSV file
+    Output:
+      Returns a text stream over data, decoded the same way open()
+      decodes the CSV files in this module.
+    """
+    return io.TextIOWrapper(io.BytesIO(data), newline='')
+
+
+def read_csv_chunk(filename, start, end, fieldnames, separator, quote):
+    """
+    Inputs:
+      filename   - name of CSV file
+      start      - byte offset of the first record in the chunk
+      end        - byte offset just past the last record in the chunk
+      fieldnames - list of field names from the header row
+      separator  - character that separates fields
+      quote      - character used to optionally quote fields
+    Output:
+      Returns a list of dictionaries, one per row in the chunk.
+    """
+    with open(filename, mode='rb') as csvfile:
+        csvfile.seek(start)
+        data = csvfile.read(end - start)
+    csv_reader = csv.DictReader(decode_csv_bytes(data), fieldnames=fieldnames,
+                                delimiter=separator, quotechar=quote)
+    return list(csv_reader)
+
+
+def read_csv_as_list_dict_parallel(filename, separator, quote, workers=None):
+    """
+    Inputs:
+      filename  - name of CSV file
+      separator - character that separates fields
+      quote     - character used to optionally quote fields
+      workers   - number of worker processes (defaults to the CPU count)
+    Output:
+      Same as read_csv_as_list_dict.  The file is split into chunks of
+      whole records, the chunks are parsed in a process pool and the
+      rows are returned in their original order.  Records must end
+      with a newline ('\n' or '\r\n').
+    """
+    workers = workers or os.cpu_count() or 1
+    boundaries = split_csv_records(filename, quote, workers)
+    with open(filename, mode='rb') as csvfile:
+        header = csvfile.read(boundaries[0])
+    fieldnames = next(csv.reader(decode_csv_bytes(header), delimiter=separator, quotechar=quote), None)
+    if fieldnames is None:
+        return []
+    starts = boundaries[:-1]
+    ends = boundaries[1:]
+    count = len(starts)
+    if workers == 1:
+        chunks = map(read_csv_chunk, [filename] * count, starts, ends, [fieldnames] * count,
+                     [separator] * count, [quote] * count)
+        return [row for chunk in chunks for row in chunk]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunks = pool.map(read_csv_chunk, [filename] * count, starts, ends, [fieldnames] * count,
+                          [separator] * count, [quote] * count)
+        return [row for chunk in chunks for row in chunk]
+
+
+def read_csv_as_nested_dict_parallel(filename, keyfield, separator, quote, workers=None):
+    """
+    Inputs:
+      filename  - name of CSV file
+      keyfield  - field to use as key for rows
+      separator - character that separates fields
+      quote     - character used to optionally quote fields
+      workers   - number of worker processes (defaults to the CPU count)
+    Output:
+      Same as read_csv_as_nested_dict, parsed in parallel as in
+      read_csv_as_list_dict_parallel.
+    """
+    rows = read_csv_as_list_dict_parallel(filename, separator, quote, workers)
+    return {row[keyfield]: row for row in rows}
+
+
 def write_csv_from_list_dict(filename, table, fieldnames, separator, quote):
     """
     Inputs:
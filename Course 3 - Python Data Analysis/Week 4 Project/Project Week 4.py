@@ -7,6 +7,95 @@ about the expected behavior of the program.
 """
 
 import csv
+import heapq
+import io
+import json
+import marshal
+import os
+import struct
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+##
+## Binary cache of parsed CSV tables
+##
+
+# Set CSV_CACHE to False to always parse the CSV text
+CSV_CACHE = True
+CSV_CACHE_SUFFIX = '.cache'
+CSV_CACHE_MAGIC = b'CSVCACH1'
+CSV_CACHE_HEADER = struct.Struct('<8sQQ')
+
+
+def read_csv_rows_cached(filename, separator, quote):
+    """
+    Inputs:
+      filename  - name of CSV file
+      separator - character that separates fields
+      quote     - character used to optionally quote fields
+    Output:
+      Returns a list of rows, starting with the header row, where
+      each row is a list of field values.  Blank lines are skipped.
+
+      The first call saves the rows to filename + CSV_CACHE_SUFFIX in
+      marshal format.  Later calls load them from there instead of
+      parsing the CSV text, as long as the CSV file's size and
+      modification time have not changed.
+    """
+    stat = os.stat(filename)
+    key = (CSV_CACHE_MAGIC, stat.st_size, stat.st_mtime_ns)
+    cachefile = filename + CSV_CACHE_SUFFIX
+    if CSV_CACHE:
+        try:
+            with open(cachefile, mode='rb') as cache:
+                if CSV_CACHE_HEADER.unpack(cache.read(CSV_CACHE_HEADER.size)) == key:
+                    cached_separator, cached_quote, rows = marshal.loads(cache.read())
+                    if (cached_separator, cached_quote) == (separator, quote):
+                        return rows
+        except (OSError, ValueError, EOFError, TypeError, struct.error):
+            pass
+
+    with open(filename, mode='r', newline='') as csvfile:
+        csvreader = csv.reader(csvfile, delimiter=separator, quotechar=quote)
+        # Share repeated values, so the cache stores each of them once
+        values = dict()
+        rows = [[values.setdefault(value, value) for value in row] for row in csvreader if row]
+    if CSV_CACHE:
+        try:
+            with open(cachefile + '.tmp', mode='wb') as cache:
+                cache.write(CSV_CACHE_HEADER.pack(*key))
+                cache.write(marshal.dumps((separator, quote, rows)))
+            os.replace(cachefile + '.tmp', cachefile)
+        except OSError:
+            pass
+    return rows
+
+
+def csv_rows_as_dicts(rows):
+    """
+    Inputs:
+      rows - list of rows from read_csv_rows_cached
+    Output:
+      Returns a list of dictionaries mapping the field names in the
+      header row to the field values of each following row, exactly
+      as csv.DictReader would.
+    """
+    if not rows:
+        return []
+    fieldnames = rows[0]
+    numfields = len(fieldnames)
+    dicts = []
+    for row in rows[1:]:
+        row_dict = dict(zip(fieldnames, row))
+        if len(row) > numfields:
+            row_dict[None] = row[numfields:]
+        else:
+            for key in fieldnames[len(row):]:
+                row_dict[key] = None
+        dicts.append(row_dict)
+    return dicts
+
 
 ##
 ## Provided code from Week 3 Project
@@ -23,12 +112,8 @@ def read_csv_as_list_dict(filename, separator, quote):
       corresponds to a row in the CSV file.  The dictionaries in the
       list map the field names to the field values for that row.
     """
-    table = []
-    with open(filename, newline='') as csvfile:
-        csvreader = csv.DictReader(csvfile, delimiter=separator, quotechar=quote)
-        for row in csvreader:
-            table.append(row)
-    return table
+    rows = read_csv_rows_cached(filename, separator, quote)
+    return csv_rows_as_dicts(rows)
 
 
 def read_csv_as_nested_dict(filename, keyfield, separator, quote):
@@ -45,12 +130,152 @@ def read_csv_as_nested_dict(filename, keyfield, separator, quote):
       field values for that row.
     """
     table = {}
+    for row in csv_rows_as_dicts(read_csv_rows_cached(filename, separator, quote)):
+        rowid = row[keyfield]
+        table[rowid] = row
+    return table
+
+
+def next_record_start(data, position, quote):
+    """
+    Inputs:
+      data     - bytes of a CSV file
+      position - byte offset to start searching from
+      quote    - quote character as bytes
+    Output:
+      Returns the offset just past the first newline at or after
+      position that is not inside a quoted field, or len(data) if
+      there is no such newline.
+    """
+    quotes = data.count(quote, 0, position)
+    while True:
+        newline = data.find(b'\n', position)
+        if newline == -1:
+            return len(data)
+        quotes += data.count(quote, position, newline)
+        # An even number of quote characters means we are outside a
+        # quoted field (escaped quotes are doubled, so they pair up)
+        if quotes % 2 == 0:
+            return newline + 1
+        position = newline + 1
+
+
+def split_csv_records(filename, quote, numchunks):
+    """
+    Inputs:
+      filename  - name of CSV file
+      quote     - character used to optionally quote fields
+      numchunks - number of chunks to split the records into
+    Output:
+      Returns a list of byte offsets.  The first offset is the end of
+      the header row, the last is the end of the file, and consecutive
+      offsets delimit chunks that each hold whole records.
+    """
+    with open(filename, mode='rb') as csvfile:
+        data = csvfile.read()
+    quote = quote.encode()
+    boundaries = [next_record_start(data, 0, quote)]
+    chunk_size = max(1, (len(data) - boundaries[0]) // numchunks)
+    while boundaries[-1] < len(data):
+        boundaries.append(next_record_start(data, boundaries[-1] + chunk_size - 1, quote))
+    return boundaries
+
+
+def decode_csv_bytes(data):
+    """
+    Inputs:
+      data - bytes read from a CSV file
+    Output:
+      Returns a text stream over data, decoded the same way open()
+      decodes the CSV files in this module.
+    """
+    return io.TextIOWrapper(io.BytesIO(data), newline='')
+
+
+def read_csv_chunk(filename, start, end, fieldnames, separator, quote):
+    """
+    Inputs:
+      filename   - name of CSV file
+      start      - byte offset of the first record in the chunk
+      end        - byte offset just past the last record in the chunk
+      fieldnames - list of field names from the header row
+      separator  - character that separates fields
+      quote      - character used to optionally quote fields
+    Output:
+      Returns a list of dictionaries, one per row in the chunk.
+    """
+    with open(filename, mode='rb') as csvfile:
+        csvfile.seek(start)
+        data = csvfile.read(end - start)
+    csvreader = csv.DictReader(decode_csv_bytes(data), fieldnames=fieldnames,
+                               delimiter=separator, quotechar=quote)
+    return list(csvreader)
+
+
+def read_csv_as_list_dict_parallel(filename, separator, quote, workers=None):
+    """
+    Inputs:
+      filename  - name of CSV file
+      separator - character that separates fields
+      quote     - character used to optionally quote fields
+      workers   - number of worker processes (defaults to the CPU count)
+    Output:
+      Same as read_csv_as_list_dict.  The file is split into chunks of
+      whole records, the chunks are parsed in a process pool and the
+      rows are returned in their original order.  Records must end
+      with a newline ('\n' or '\r\n').
+    """
+    workers = workers or os.cpu_count() or 1
+    boundaries = split_csv_records(filename, quote, workers)
+    with open(filename, mode='rb') as csvfile:
+        header = csvfile.read(boundaries[0])
+    fieldnames = next(csv.reader(decode_csv_bytes(header), delimiter=separator, quotechar=quote), None)
+    if fieldnames is None:
+        return []
+    starts = boundaries[:-1]
+    ends = boundaries[1:]
+    count = len(starts)
+    if workers == 1:
+        chunks = map(read_csv_chunk, [filename] * count, starts, ends, [fieldnames] * count,
+                     [separator] * count, [quote] * count)
+        return [row for chunk in chunks for row in chunk]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunks = pool.map(read_csv_chunk, [filename] * count, starts, ends, [fieldnames] * count,
+                          [separator] * count, [quote] * count)
+        return [row for chunk in chunks for row in chunk]
+
+
+def read_csv_as_nested_dict_parallel(filename, keyfield, separator, quote, workers=None):
+    """
+    Inputs:
+      filename  - name of CSV file
+      keyfield  - field to use as key for rows
+      separator - character that separates fields
+      quote     - character used to optionally quote fields
+      workers   - number of worker processes (defaults to the CPU count)
+    Output:
+      Same as read_csv_as_nested_dict, parsed in parallel as in
+      read_csv_as_list_dict_parallel.
+    """
+    rows = read_csv_as_list_dict_parallel(filename, separator, quote, workers)
+    return {row[keyfield]: row for row in rows}
+
+
+def iter_csv_rows(filename, separator, quote):
+    """
+    Inputs:
+      filename  - name of CSV file
+      separator - character that separates fields
+      quote     - character used to optionally quote fields
+    Output:
+      Generates one dictionary per row of the CSV file, mapping the
+      field names to the field values for that row.  Only one row is
+      held in memory at a time.
+    """
     with open(filename, newline='') as csvfile:
         csvreader = csv.DictReader(csvfile, delimiter=separator, quotechar=quote)
         for row in csvreader:
-            rowid = row[keyfield]
-            table[rowid] = row
-    return table
+            yield row
 
 ##
 ## Provided formulas for common batting statistics
@@ -107,6 +332,89 @@ def slugging_percentage(info, batting_stats):
         return 0
 
 
+##
+## Batch versions of the formulas, computed over whole columns
+##
+
+def batting_average_columns(info, columns):
+    """
+    Inputs:
+      columns - dictionary of batting statistics columns (see
+                read_batting_columns)
+    Output:
+      Returns a list with the batting average of every row
+    """
+    return [hits / at_bats if at_bats >= MINIMUM_AB else 0
+            for hits, at_bats in zip(columns[info["hits"]], columns[info["atbats"]])]
+
+def onbase_percentage_columns(info, columns):
+    """
+    Inputs:
+      columns - dictionary of batting statistics columns (see
+                read_batting_columns)
+    Output:
+      Returns a list with the on-base percentage of every row
+    """
+    return [(hits + walks) / (at_bats + walks) if at_bats >= MINIMUM_AB else 0
+            for hits, at_bats, walks in zip(columns[info["hits"]],
+                                            columns[info["atbats"]],
+                                            columns[info["walks"]])]
+
+def slugging_percentage_columns(info, columns):
+    """
+    Inputs:
+      columns - dictionary of batting statistics columns (see
+                read_batting_columns)
+    Output:
+      Returns a list with the slugging percentage of every row
+    """
+    slugging = []
+    for hits, doubles, triples, home_runs, at_bats in zip(columns[info["hits"]],
+                                                          columns[info["doubles"]],
+                                                          columns[info["triples"]],
+                                                          columns[info["homeruns"]],
+                                                          columns[info["atbats"]]):
+        if at_bats >= MINIMUM_AB:
+            singles = hits - doubles - triples - home_runs
+            slugging.append((singles + 2 * doubles + 3 * triples + 4 * home_runs) / at_bats)
+        else:
+            slugging.append(0)
+    return slugging
+
+# Per-row formula -> batch formula computing the same values
+BATCH_FORMULAS = {batting_average: batting_average_columns,
+                  onbase_percentage: onbase_percentage_columns,
+                  slugging_percentage: slugging_percentage_columns}
+
+# Formulas built by sum_formulas, keyed by the tuple of formulas summed
+SUMMED_FORMULAS = {}
+
+def sum_formulas(*formulas):
+    """
+    Inputs:
+      formulas - per-row formulas that all have batch versions
+    Output:
+      Returns a per-row formula computing the sum of the given
+      formulas.  Its batch version is added to BATCH_FORMULAS, so
+      sessions evaluate it over whole columns.
+
+      The formula is built once per tuple of formulas; later calls
+      with the same formulas return the same function.
+    """
+    if formulas in SUMMED_FORMULAS:
+        return SUMMED_FORMULAS[formulas]
+    batch_formulas = [BATCH_FORMULAS[formula] for formula in formulas]
+
+    def formula_sum(info, batting_stats):
+        return sum(formula(info, batting_stats) for formula in formulas)
+
+    def formula_sum_columns(info, columns):
+        return [sum(values) for values in zip(*[batch(info, columns) for batch in batch_formulas])]
+
+    BATCH_FORMULAS[formula_sum] = formula_sum_columns
+    SUMMED_FORMULAS[formulas] = formula_sum
+    return formula_sum
+
 ##
 ## Part 1: Functions to compute top batting statistics by year
 ##
@@ -140,12 +448,140 @@ def top_player_ids(info, statistics, formula, numplayers):
       computed by formula, of the top numplayers players sorted in
       decreasing order of the computed statistic.
     """
-    info_list = list()
-    for diction in statistics:
-        player_info = (diction[info["playerid"]], formula(info, diction))
-        info_list.append(player_info)
-    sorted_info_list = sorted(info_list, key=lambda stat: stat[1], reverse=True)
-    return sorted_info_list[:numplayers]
+    info_list = ((diction[info["playerid"]], formula(info, diction)) for diction in statistics)
+    # heapq.nlargest keeps ties in input order, exactly like a stable
+    # reverse sort followed by a slice, but only holds numplayers items
+    return heapq.nlargest(numplayers, info_list, key=lambda stat: stat[1])
+
+
+# Player indexes already built, keyed by the info fields they depend on
+PLAYER_INDEXES = {}
+
+# Info fields that the contents of a player index depend on
+PLAYER_INDEX_FIELDS = ('masterfile', 'playerid', 'firstname', 'lastname', 'separator', 'quote')
+
+def build_player_index(info):
+    """
+    Inputs:
+      info - Baseball data information dictionary
+    Output:
+      Returns a dictionary mapping each player ID in the master file
+      to a (first name, last name) tuple.
+    """
+    index = {}
+    for row in read_csv_as_list_dict(info['masterfile'], info['separator'], info['quote']):
+        index[row[info['playerid']]] = (row[info['firstname']], row[info['lastname']])
+    return index
+
+
+def read_player_index(indexfile, header, separator, quote):
+    """
+    Inputs:
+      indexfile - name of a player index file written by write_player_index
+      header    - list of strings the first row of indexfile must hold
+      separator - character that separates fields
+      quote     - character used to optionally quote fields
+    Output:
+      Returns the player index dictionary stored in indexfile, or None
+      if its first row is not header.
+    """
+    with open(indexfile, newline='') as csvfile:
+        csvreader = csv.reader(csvfile, delimiter=separator, quotechar=quote)
+        if next(csvreader, None) != header:
+            return None
+        return {row[0]: (row[1], row[2]) for row in csvreader}
+
+
+def write_player_index(indexfile, index, header, separator, quote):
+    """
+    Inputs:
+      indexfile - name of the player index file to write
+      index     - player index dictionary
+      header    - list of strings to write as the first row
+      separator - character that separates fields
+      quote     - character used to optionally quote fields
+    Output:
+      Writes header, then one "playerID,first,last" row per player to
+      indexfile.
+    """
+    with open(indexfile, 'w', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile, delimiter=separator, quotechar=quote)
+        csvwriter.writerow(header)
+        for playerid, (firstname, lastname) in index.items():
+            csvwriter.writerow([playerid, firstname, lastname])
+
+
+def load_player_index(info):
+    """
+    Inputs:
+      info - Baseball data information dictionary
+    Output:
+      Returns the player index for info['masterfile'].  The index is
+      built once per set of PLAYER_INDEX_FIELDS values and kept in
+      memory until the master file changes.
+
+      If info has a "masterindex" entry, the index is also saved to
+      that file and reloaded from it on later runs, as long as the
+      index file is newer than the master file and was written for
+      the same fields.
+    """
+    key = tuple(info[field] for field in PLAYER_INDEX_FIELDS)
+    mtime = os.path.getmtime(info['masterfile'])
+    cached = PLAYER_INDEXES.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    # The first row of the index file records the fields it was built from
+    header = list(key[1:])
+    indexfile = info.get('masterindex')
+    index = None
+    if indexfile and os.path.exists(indexfile) and os.path.getmtime(indexfile) >= mtime:
+        index = read_player_index(indexfile, header, info['separator'], info['quote'])
+    if index is None:
+        index = build_player_index(info)
+        if indexfile:
+            write_player_index(indexfile, index, header, info['separator'], info['quote'])
+    PLAYER_INDEXES[key] = (mtime, index)
+    return index
+
+
+def top_player_ids_columns(info, columns, batch_formula, numplayers):
+    """
+    Inputs:
+      info          - Baseball data information dictionary
+      columns       - dictionary of batting statistics columns
+      batch_formula - function that takes an info dictionary and a
+                      dictionary of columns as input and computes a
+                      compound statistic for every row
+      numplayers    - Number of top players to return
+    Outputs:
+      Same as top_player_ids, computed from columns.
+    """
+    values = batch_formula(info, columns)
+    player_ids = columns[info["playerid"]]
+    # Select the row numbers of the top values, then fetch only those rows
+    top_rows = heapq.nlargest(numplayers, range(len(values)), key=values.__getitem__)
+    return [(player_ids[row], values[row]) for row in top_rows]
+
+
+def format_player_names(player_index, top_ids_and_stats):
+    """
+    Inputs:
+      player_index      - player index dictionary from load_player_index
+      top_ids_and_stats - list of tuples containing player IDs and
+                          computed statistics
+    Outputs:
+      List of strings of the form "x.xxx --- FirstName LastName".
+      Player IDs missing from player_index are skipped.
+    """
+    lookup_list = []
+    for player_id, stat in top_ids_and_stats:
+        if player_id in player_index:
+            player_fname, player_lname = player_index[player_id]
+            stat = '{:.3f}'.format(stat)
+            format_str = stat+' --- '+player_fname+' '+player_lname
+            lookup_list.append(format_str)
+    return lookup_list
 
 
 def lookup_player_names(info, top_ids_and_stats):
@@ -160,19 +596,7 @@ def lookup_player_names(info, top_ids_and_stats):
       the input and "FirstName LastName" is the name of the player
       corresponding to the player ID in the input.
     """
-    lookup_list = []
-    statistics =  read_csv_as_list_dict(info['masterfile'], info['separator'], info['quote'])
-    for player in top_ids_and_stats:
-        current_player_id = player[0]
-        for dictionary in statistics:
-            if dictionary[info['playerid']] == current_player_id:
-                player_fname = dictionary[info['firstname']]
-                player_lname = dictionary[info['lastname']]
-                stat = player[1]
-                stat = '{:.3f}'.format(stat)
-                format_str = stat+' --- '+player_fname+' '+player_lname
-                lookup_list.append(format_str)
-    return lookup_list
+    return format_player_names(load_player_index(info), top_ids_and_stats)
 
 
 def compute_top_stats_year(info, formula, numplayers, year):
@@ -226,6 +650,164 @@ def aggregate_by_player_id(statistics, playerid, fields):
     return agg_dict
 
 
+def aggregate_stream_by_player_id(rows, playerid, fields, agg_dict=None):
+    """
+    Inputs:
+      rows     - iterable of batting statistics dictionaries
+      playerid - Player ID field name
+      fields   - List of fields to aggregate
+      agg_dict - optional totals from an earlier call to add rows to
+    Output:
+      Returns a dictionary whose keys are player IDs and whose values
+      are integer arrays of the aggregated fields, in the order of
+      fields.  rows is consumed one row at a time, so it can be a
+      generator such as iter_csv_rows.
+    """
+    if agg_dict is None:
+        agg_dict = dict()
+    for dict_row in rows:
+        values = [int(dict_row[field]) for field in fields]
+        totals = agg_dict.get(dict_row[playerid])
+        if totals is None:
+            agg_dict[dict_row[playerid]] = array('l', values)
+        else:
+            for position, value in enumerate(values):
+                totals[position] += value
+    return agg_dict
+
+
+def iter_career_stats(agg_dict, playerid, fields):
+    """
+    Inputs:
+      agg_dict - dictionary from aggregate_stream_by_player_id
+      playerid - Player ID field name
+      fields   - List of aggregated fields
+    Output:
+      Generates one career statistics dictionary per player, in the
+      format returned by aggregate_by_player_id.
+    """
+    for player_id, totals in agg_dict.items():
+        career_stats = dict(zip(fields, totals))
+        career_stats[playerid] = player_id
+        yield career_stats
+
+
+def iter_new_records(battingfile, quote, encoding, snapshot):
+    """
+    Inputs:
+      battingfile - batting file opened in binary mode, positioned at
+                    a record boundary
+      quote       - quote character as bytes
+      encoding    - text encoding of the batting file
+      snapshot    - career snapshot dictionary
+    Output:
+      Generates each complete CSV record from the current position as
+      a string, reading one line at a time.  A trailing partial record
+      that is still being written is not generated.  snapshot['offset']
+      and snapshot['rows'] are advanced past each record as it is
+      generated.
+    """
+    record = b''
+    for line in battingfile:
+        record += line
+        # A newline inside quotes does not end the record
+        if record.endswith(b'\n') and record.count(quote) % 2 == 0:
+            snapshot['offset'] += len(record)
+            text = record.decode(encoding)
+            if text.rstrip('\r\n'):
+                snapshot['rows'] += 1
+            yield text
+            record = b''
+
+
+def read_career_snapshot(snapshotfile, header, playerid, fields, size):
+    """
+    Inputs:
+      snapshotfile - name of the JSON file holding the career totals
+      header       - header line of the batting file
+      playerid     - Player ID field name
+      fields       - List of fields to aggregate
+      size         - size of the batting file in bytes
+    Output:
+      Returns the snapshot dictionary stored in snapshotfile, with its
+      totals as arrays in the format of aggregate_stream_by_player_id.
+
+      Returns None if the file is missing, corrupt or in an older
+      format, was made for another header, player ID field or fields,
+      or has folded in more bytes than the batting file holds.
+    """
+    if not os.path.exists(snapshotfile):
+        return None
+    try:
+        with open(snapshotfile) as jsonfile:
+            stored = json.load(jsonfile)
+        if (stored['header'] != header or stored['playerid'] != playerid or
+                stored['fields'] != fields or stored['offset'] > size):
+            return None
+        return {'header': header, 'playerid': playerid, 'fields': fields,
+                'offset': stored['offset'], 'rows': stored['rows'],
+                'totals': {player_id: array('l', totals)
+                           for player_id, totals in stored['totals'].items()}}
+    except (ValueError, KeyError, TypeError, AttributeError, OverflowError):
+        return None
+
+
+def update_career_snapshot(info, snapshotfile):
+    """
+    Inputs:
+      info         - Baseball data information dictionary
+      snapshotfile - name of the JSON file holding the career totals
+    Output:
+      Returns career totals in the format of aggregate_stream_by_player_id.
+
+      The snapshot records the totals together with the number of
+      bytes and rows of the batting file already folded in.  When new
+      seasons are appended to the batting file, only the new rows are
+      read, one record at a time.  The totals are rebuilt from scratch
+      if the snapshot is missing, corrupt or in an older format, was
+      made for other fields, or the batting file has a different
+      header or is smaller than the part already folded in.
+
+      The batting file must only ever be appended to.  Rows before the
+      snapshot offset are not read again, so edits to them are not
+      noticed; delete the snapshot file after such an edit.
+    """
+    playerid = info['playerid']
+    fields = info['battingfields']
+    quote = info['quote'].encode()
+    with open(info['battingfile'], mode='rb') as battingfile:
+        size = os.fstat(battingfile.fileno()).st_size
+        header_bytes = battingfile.readline()
+        while header_bytes.count(quote) % 2:
+            header_bytes += battingfile.readline()
+        header = header_bytes.decode()
+
+        snapshot = read_career_snapshot(snapshotfile, header, playerid, fields, size)
+        if snapshot is None:
+            snapshot = {'header': header, 'playerid': playerid, 'fields': fields,
+                        'offset': len(header_bytes), 'rows': 0, 'totals': {}}
+        agg_dict = snapshot['totals']
+
+        start_offset = snapshot['offset']
+        battingfile.seek(start_offset)
+        fieldnames = next(csv.reader(decode_csv_bytes(header_bytes),
+                                     delimiter=info['separator'], quotechar=info['quote']))
+        encoding = decode_csv_bytes(b'').encoding
+        records = iter_new_records(battingfile, quote, encoding, snapshot)
+        csvreader = csv.DictReader(records, fieldnames=fieldnames,
+                                   delimiter=info['separator'], quotechar=info['quote'])
+        aggregate_stream_by_player_id(csvreader, playerid, fields, agg_dict)
+
+    if snapshot['offset'] != start_offset:
+        snapshot['totals'] = {player_id: list(totals) for player_id, totals in agg_dict.items()}
+        # Write to a temporary file first so an interrupted run never
+        # leaves a half-written snapshot behind
+        with open(snapshotfile + '.tmp', 'w') as jsonfile:
+            json.dump(snapshot, jsonfile)
+        os.replace(snapshotfile + '.tmp', snapshotfile)
+    return agg_dict
+
+
 def compute_top_stats_career(info, formula, numplayers):
     """
     Inputs:
@@ -234,19 +816,226 @@ def compute_top_stats_career(info, formula, numplayers):
                     batting statistics dictionary as input and
                     computes a compound statistic
       numplayers  - Number of top players to return
+
+      If info has a "careersnapshot" entry, career totals are kept in
+      that file and only rows appended since the last run are read
+      (see update_career_snapshot).
     """
-    statistics = read_csv_as_list_dict(info['battingfile'], info['separator'], info['quote'])
-    # Convert the required information into the needed format
-    batting_agg_data = aggregate_by_player_id(statistics, info['playerid'], info['battingfields'])
-    # batting_agg_data is a dictionary of dictionaries,
-    # we need to convert it to a list of dictionaries
-    list_of_dicts = [batting_agg_data[key] for key in batting_agg_data]
+    if info.get('careersnapshot'):
+        batting_agg_data = update_career_snapshot(info, info['careersnapshot'])
+    else:
+        # Stream the batting file, keeping only per-player totals
+        rows = iter_csv_rows(info['battingfile'], info['separator'], info['quote'])
+        batting_agg_data = aggregate_stream_by_player_id(rows, info['playerid'],
+                                                         info['battingfields'])
+    career_stats = iter_career_stats(batting_agg_data, info['playerid'], info['battingfields'])
     # Top numplayers from the battingfile statistics
-    tpis = top_player_ids(info, list_of_dicts, formula, numplayers)
+    tpis = top_player_ids(info, career_stats, formula, numplayers)
     top_players = lookup_player_names(info, tpis)
     return top_players
 
 
+##
+## Part 3: Load-once batting data sessions
+##
+
+def read_batting_columns(info):
+    """
+    Inputs:
+      info - Baseball data information dictionary
+    Output:
+      Returns a dictionary of columns read from the batting file.  The
+      player ID field maps to a list of strings, and the year ID field
+      and every field in info['battingfields'] map to integer arrays.
+      Row i of the file is made up of element i of every column.
+    """
+    playerid = info['playerid']
+    yearid = info['yearid']
+    fields = info['battingfields']
+    columns = {playerid: [], yearid: array('l')}
+    for field in fields:
+        columns[field] = array('l')
+    with open(info['battingfile'], newline='') as csvfile:
+        csvreader = csv.DictReader(csvfile, delimiter=info['separator'], quotechar=info['quote'])
+        for row in csvreader:
+            columns[playerid].append(row[playerid])
+            columns[yearid].append(int(row[yearid]))
+            for field in fields:
+                columns[field].append(int(row[field]))
+    return columns
+
+
+def column_row(columns, row):
+    """
+    Inputs:
+      columns - dictionary of columns from read_batting_columns
+      row     - row number
+    Output:
+      Returns a batting statistics dictionary for the given row.  The
+      values are already converted, so the formulas can use it directly.
+    """
+    return {field: column[row] for field, column in columns.items()}
+
+
+def select_rows(columns, rows):
+    """
+    Inputs:
+      columns - dictionary of columns from read_batting_columns
+      rows    - list of row numbers
+    Output:
+      Returns a dictionary of columns holding only the given rows.
+    """
+    selected = {}
+    for field, column in columns.items():
+        values = [column[row] for row in rows]
+        selected[field] = array(column.typecode, values) if isinstance(column, array) else values
+    return selected
+
+
+def build_year_index(years):
+    """
+    Inputs:
+      years - column of year IDs
+    Output:
+      Returns a dictionary mapping each year to an array of the row
+      numbers from that year, in increasing order.
+    """
+    year_index = {}
+    for row, year in enumerate(years):
+        if year not in year_index:
+            year_index[year] = array('l')
+        year_index[year].append(row)
+    return year_index
+
+
+def rows_in_years(year_index, first_year, last_year):
+    """
+    Inputs:
+      year_index - dictionary from build_year_index
+      first_year - first year of the range
+      last_year  - last year of the range (inclusive)
+    Output:
+      Returns a list of the row numbers from first_year through
+      last_year, in increasing order.
+    """
+    year_rows = [year_index[year] for year in range(first_year, last_year + 1)
+                 if year in year_index]
+    return list(heapq.merge(*year_rows))
+
+
+def aggregate_columns_by_player_id(columns, playerid, fields):
+    """
+    Inputs:
+      columns  - dictionary of columns from read_batting_columns
+      playerid - Player ID field name
+      fields   - List of fields to aggregate
+    Output:
+      Same as aggregate_by_player_id, computed from columns.
+    """
+    agg_dict = dict()
+    field_columns = [(field, columns[field]) for field in fields]
+    for row, player_id in enumerate(columns[playerid]):
+        if player_id not in agg_dict:
+            agg_dict[player_id] = {playerid: player_id}
+            for field, column in field_columns:
+                agg_dict[player_id][field] = column[row]
+        else:
+            for field, column in field_columns:
+                agg_dict[player_id][field] += column[row]
+    return agg_dict
+
+
+class BattingSession:
+    """
+    Batting and master data loaded once from a baseball data
+    information dictionary and kept in memory, so repeated top-N
+    queries do no file I/O.  The batting data is held as typed
+    columns (see read_batting_columns).
+    """
+
+    def __init__(self, info):
+        """
+        Inputs:
+          info - Baseball data information dictionary
+        """
+        self.info = info
+        self.columns = read_batting_columns(info)
+        self.year_index = build_year_index(self.columns[info['yearid']])
+        self.player_index = load_player_index(info)
+        self.career_columns = None
+
+    def top_ids(self, columns, formula, numplayers):
+        """
+        Inputs:
+          columns    - dictionary of batting statistics columns
+          formula    - per-row formula, see top_player_ids
+          numplayers - Number of top players to return
+        Outputs:
+          Same as top_player_ids.  Formulas with a batch version in
+          BATCH_FORMULAS are evaluated over whole columns; any other
+          formula is called once per row.
+        """
+        batch_formula = BATCH_FORMULAS.get(formula)
+        if batch_formula is not None:
+            return top_player_ids_columns(self.info, columns, batch_formula, numplayers)
+        statistics = [column_row(columns, row) for row in range(len(columns[self.info['playerid']]))]
+        return top_player_ids(self.info, statistics, formula, numplayers)
+
+    def top_stats_year(self, formula, numplayers, year):
+        """
+        Inputs:
+          formula     - function that takes an info dictionary and a
+                        batting statistics dictionary as input and
+                        computes a compound statistic
+          numplayers  - Number of top players to return
+          year        - Year to filter by
+        Outputs:
+          Same as compute_top_stats_year, without re-reading any files.
+        """
+        rows = self.year_index.get(year, [])
+        top_players_info = self.top_ids(select_rows(self.columns, rows), formula, numplayers)
+        return format_player_names(self.player_index, top_players_info)
+
+    def top_stats_years(self, formula, numplayers, first_year, last_year):
+        """
+        Inputs:
+          formula     - function that takes an info dictionary and a
+                        batting statistics dictionary as input and
+                        computes a compound statistic
+          numplayers  - Number of top players to return
+          first_year  - First year of the range
+          last_year   - Last year of the range (inclusive)
+        Outputs:
+          Returns a list of strings for the top numplayers single-season
+          statistics from first_year through last_year.
+        """
+        rows = rows_in_years(self.year_index, first_year, last_year)
+        top_players_info = self.top_ids(select_rows(self.columns, rows), formula, numplayers)
+        return format_player_names(self.player_index, top_players_info)
+
+    def top_stats_career(self, formula, numplayers):
+        """
+        Inputs:
+          formula     - function that takes an info dictionary and a
+                        batting statistics dictionary as input and
+                        computes a compound statistic
+          numplayers  - Number of top players to return
+        Outputs:
+          Same as compute_top_stats_career, without re-reading any files.
+          Career totals are aggregated on the first call and reused.
+        """
+        if self.career_columns is None:
+            batting_agg_data = aggregate_columns_by_player_id(self.columns,
+                                                              self.info['playerid'],
+                                                              self.info['battingfields'])
+            self.career_columns = {self.info['playerid']: list(batting_agg_data)}
+            for field in self.info['battingfields']:
+                self.career_columns[field] = array('l', (totals[field] for totals
+                                                         in batting_agg_data.values()))
+        tpis = self.top_ids(self.career_columns, formula, numplayers)
+        return format_player_names(self.player_index, tpis)
+
+
 ##
 ## Provided testing code
 ##
@@ -276,35 +1065,39 @@ def test_baseball_statistics():
                         "walks": "BB",                     # Walks field name
                         "battingfields": ["AB", "H", "2B", "3B", "HR", "BB"]}
 
+    # Load the CSV files once and answer every query from memory
+    session = BattingSession(baseballdatainfo)
+
     print("Top 5 batting averages in 1923")
-    top_batting_average_1923 = compute_top_stats_year(baseballdatainfo, batting_average, 5, 1923)
+    top_batting_average_1923 = session.top_stats_year(batting_average, 5, 1923)
     for player in top_batting_average_1923:
         print(player)
     print("")
 
     print("Top 10 batting averages in 2010")
-    top_batting_average_2010 = compute_top_stats_year(baseballdatainfo, batting_average, 10, 2010)
+    top_batting_average_2010 = session.top_stats_year(batting_average, 10, 2010)
     for player in top_batting_average_2010:
         print(player)
     print("")
 
     print("Top 10 on-base percentage in 2010")
-    top_onbase_2010 = compute_top_stats_year(baseballdatainfo, onbase_percentage, 10, 2010)
+    top_onbase_2010 = session.top_stats_year(onbase_percentage, 10, 2010)
     for player in top_onbase_2010:
         print(player)
     print("")
 
     print("Top 10 slugging percentage in 2010")
-    top_slugging_2010 = compute_top_stats_year(baseballdatainfo, slugging_percentage, 10, 2010)
+    top_slugging_2010 = session.top_stats_year(slugging_percentage, 10, 2010)
     for player in top_slugging_2010:
         print(player)
     print("")
 
     # You can also use lambdas for the formula
     #  This one computes onbase plus slugging percentage
+    #  (sum_formulas(onbase_percentage, slugging_percentage) computes
+    #  the same values over whole columns at once)
     print("Top 10 OPS in 2010")
-    top_ops_2010 = compute_top_stats_year(baseballdatainfo,
-                                          lambda info, stats: (onbase_percentage(info, stats) +
+    top_ops_2010 = session.top_stats_year(lambda info, stats: (onbase_percentage(info, stats) +
                                                                slugging_percentage(info, stats)),
                                           10, 2010)
     for player in top_ops_2010:
@@ -312,13 +1105,33 @@ def test_baseball_statistics():
     print("")
 
     print("Top 20 career batting averages")
-    top_batting_average_career = compute_top_stats_career(baseballdatainfo, batting_average, 20)
+    top_batting_average_career = session.top_stats_career(batting_average, 20)
     for player in top_batting_average_career:
         print(player)
     print("")
 
 
+def time_parallel_read(filename, separator, quote, worker_counts=(1, 2, 4, 8)):
+    """
+    Time read_csv_as_list_dict and read_csv_as_list_dict_parallel
+    on the given file, for each number of workers.
+    """
+    start = time.perf_counter()
+    table = read_csv_as_list_dict(filename, separator, quote)
+    print("read_csv_as_list_dict: {:.3f}s ({} rows)".format(time.perf_counter() - start, len(table)))
+    for workers in worker_counts:
+        start = time.perf_counter()
+        parallel_table = read_csv_as_list_dict_parallel(filename, separator, quote, workers)
+        elapsed = time.perf_counter() - start
+        print("read_csv_as_list_dict_parallel, {} workers: {:.3f}s{}".format(
+            workers, elapsed, "" if parallel_table == table else " (MISMATCH)"))
+
+
 # Make sure the following call to test_baseball_statistics is
-# commented out when submitting to OwlTest/CourseraTest.
+# commented out when submitting to OwlTest/CourseraTest.  Keep the
+# calls under the __main__ guard: the worker processes of
+# time_parallel_read import this module.
 
-# test_baseball_statistics()
+# if __name__ == '__main__':
+#     test_baseball_statistics()
+#     time_parallel_read("Batting_2016.csv", ",", '"')
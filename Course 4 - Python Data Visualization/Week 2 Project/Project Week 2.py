@@ -7,8 +7,90 @@ about the expected behavior of the program.
 """
 
 import csv
+import math
+import marshal
+import os
+import struct
+import tempfile
+import time
 import pygal
 
+# Set CSV_CACHE to False to always parse the CSV text
+CSV_CACHE = True
+CSV_CACHE_SUFFIX = '.cache'
+CSV_CACHE_MAGIC = b'CSVCACH1'
+CSV_CACHE_HEADER = struct.Struct('<8sQQ')
+
+
+def read_csv_rows_cached(filename, separator, quote):
+    """
+    Inputs:
+      filename  - name of CSV file
+      separator - character that separates fields
+      quote     - character used to optionally quote fields
+    Output:
+      Returns a list of rows, starting with the header row, where
+      each row is a list of field values.  Blank lines are skipped.
+
+      The first call saves the rows to filename + CSV_CACHE_SUFFIX in
+      marshal format.  Later calls load them from there instead of
+      parsing the CSV text, as long as the CSV file's size and
+      modification time have not changed.
+    """
+    stat = os.stat(filename)
+    key = (CSV_CACHE_MAGIC, stat.st_size, stat.st_mtime_ns)
+    cachefile = filename + CSV_CACHE_SUFFIX
+    if CSV_CACHE:
+        try:
+            with open(cachefile, mode='rb') as cache:
+                if CSV_CACHE_HEADER.unpack(cache.read(CSV_CACHE_HEADER.size)) == key:
+                    cached_separator, cached_quote, rows = marshal.loads(cache.read())
+                    if (cached_separator, cached_quote) == (separator, quote):
+                        return rows
+        except (OSError, ValueError, EOFError, TypeError, struct.error):
+            pass
+
+    with open(filename, mode='r', newline='') as csvfile:
+        csv_reader = csv.reader(csvfile, delimiter=separator, quotechar=quote)
+        # Share repeated values, so the cache stores each of them once
+        values = dict()
+        rows = [[values.setdefault(value, value) for value in row] for row in csv_reader if row]
+    if CSV_CACHE:
+        try:
+            with open(cachefile + '.tmp', mode='wb') as cache:
+                cache.write(CSV_CACHE_HEADER.pack(*key))
+                cache.write(marshal.dumps((separator, quote, rows)))
+            os.replace(cachefile + '.tmp', cachefile)
+        except OSError:
+            pass
+    return rows
+
+
+def csv_rows_as_dicts(rows):
+    """
+    Inputs:
+      rows - list of rows from read_csv_rows_cached
+    Output:
+      Returns a list of dictionaries mapping the field names in the
+      header row to the field values of each following row, exactly
+      as csv.DictReader would.
+    """
+    if not rows:
+        return []
+    fieldnames = rows[0]
+    numfields = len(fieldnames)
+    dicts = []
+    for row in rows[1:]:
+        row_dict = dict(zip(fieldnames, row))
+        if len(row) > numfields:
+            row_dict[None] = row[numfields:]
+        else:
+            for key in fieldnames[len(row):]:
+                row_dict[key] = None
+        dicts.append(row_dict)
+    return dicts
+
+
 def read_csv_as_nested_dict(filename, keyfield, separator, quote):
     """
     Inputs:
@@ -23,14 +105,82 @@ def read_csv_as_nested_dict(filename, keyfield, separator, quote):
       CSV file.  The inner dictionaries map the field names to the
       field values for that row.
     """
+    rows = read_csv_rows_cached(filename, separator, quote)
+    row_dict = dict()
+    for row in csv_rows_as_dicts(rows):
+        row_dict[row[keyfield]] = row
+    return row_dict
+
+
+def read_csv_projection(filename, keyfield, keys, fields, separator, quote):
+    """
+    Inputs:
+      filename  - Name of CSV file
+      keyfield  - Field to use as key for rows
+      keys      - Collection of the key values of the rows to read
+      fields    - List of the fields to read from those rows
+      separator - Character that separates fields
+      quote     - Character used to optionally quote fields
+
+    Output:
+      Returns a dictionary mapping each value from keys that appears
+      in the key_field of the CSV file to a dictionary of the given
+      fields (those that exist in the file) and their values for
+      that row.  Only lines that contain the text of one of the keys
+      are parsed; all other lines are skipped.
+    """
+    keys = set(keys)
+    # Inside a quoted field, quote characters are doubled
+    key_texts = [key.replace(quote, quote * 2) for key in keys]
     row_dict = dict()
     with open(filename, mode='r', newline='') as csvfile:
-        csv_reader = csv.DictReader(csvfile,delimiter=separator,quotechar=quote)
-        for row in csv_reader:
-            row_dict[row[keyfield]] = row
+        header = next(csv.reader(csvfile, delimiter=separator, quotechar=quote), [])
+        if keyfield not in header:
+            return row_dict
+        key_position = header.index(keyfield)
+        positions = [(field, header.index(field)) for field in fields if field in header]
+        record = ''
+        for line in csvfile:
+            record += line
+            # An odd number of quote characters means a quoted field
+            # continues on the next line
+            if record.count(quote) % 2:
+                continue
+            if any(key_text in record for key_text in key_texts):
+                row = next(csv.reader([record], delimiter=separator, quotechar=quote), [])
+                if len(row) > key_position and row[key_position] in keys:
+                    row_dict[row[key_position]] = {field: row[position] for field, position
+                                                   in positions if position < len(row)}
+            record = ''
     return row_dict
 
 
+# Year columns already resolved, keyed by year range and field names
+YEAR_COLUMNS = dict()
+
+def build_year_columns(gdpinfo, fieldnames):
+    """
+    Inputs:
+      gdpinfo    - GDP data information dictionary
+      fieldnames - Field names of a GDP data row, in header order
+
+    Output:
+      Returns a list of tuples of the form (year, field name) for the
+      fields that are years between "min_year" and "max_year",
+      inclusive, sorted by year.  The list is computed once for each
+      year range and set of field names and then reused.
+    """
+    fieldnames = tuple(fieldnames)
+    key = (gdpinfo['min_year'], gdpinfo['max_year'], fieldnames)
+    if key not in YEAR_COLUMNS:
+        years = range(gdpinfo['min_year'], gdpinfo['max_year'] + 1)
+        columns = [(int(field), field) for field in fieldnames
+                   if field.strip().isdecimal() and int(field) in years]
+        columns.sort(key=lambda column: column[0])
+        YEAR_COLUMNS[key] = columns
+    return YEAR_COLUMNS[key]
+
+
 def build_plot_values(gdpinfo, gdpdata):
     """
     Inputs:
@@ -47,13 +197,12 @@ def build_plot_values(gdpinfo, gdpdata):
       be a float.
     """
     gdp_list = list()
-    for stat in gdpdata.items():
+    for year, field in build_year_columns(gdpinfo, gdpdata):
+        # Skip blank and non-numeric cells, such as the ".." missing-value marker
         try:
-            if int(stat[0]) in range(gdpinfo['min_year'],gdpinfo['max_year']+1):
-                gdp_list.append((int(stat[0]),float(stat[1])))
+            gdp_list.append((year, float(gdpdata[field])))
         except ValueError:
             continue
-    gdp_list.sort(key=lambda stat: stat[0], reverse=False)
     return gdp_list
 
 
@@ -77,45 +226,138 @@ def build_plot_dict(gdpinfo, country_list):
     keyfield = gdpinfo['country_name']
     separator = gdpinfo['separator']
     quote = gdpinfo['quote']
-    nested_dict = read_csv_as_nested_dict(filename,keyfield,separator,quote)
-    
+    # Only read the requested countries and years from the file
+    years = [str(year) for year in range(gdpinfo['min_year'], gdpinfo['max_year'] + 1)]
+    country_rows = read_csv_projection(filename,keyfield,country_list,years,separator,quote)
+
     for country_name in country_list:
-        if country_name in nested_dict.keys():
-            country_data_row = list(nested_dict[country_name].items())
-            country_data_dict = dict(country_data_row)
-            dict_xy[country_name] = build_plot_values(gdpinfo, country_data_dict)
+        if country_name in country_rows:
+            dict_xy[country_name] = build_plot_values(gdpinfo, country_rows[country_name])
         else:
             dict_xy[country_name] = []
     return dict_xy
 
 
-def render_xy_plot(gdpinfo, country_list, plot_file):
+def triangle_area(point_a, point_b, point_c):
     """
     Inputs:
-      gdpinfo      - GDP data information dictionary
-      country_list - List of strings that are country names
-      plot_file    - String that is the output plot file name
+      point_a, point_b, point_c - (x, y) tuples
+
+    Output:
+      Returns twice the area of the triangle with the given corners.
+    """
+    return abs((point_a[0] - point_c[0]) * (point_b[1] - point_a[1]) -
+               (point_a[0] - point_b[0]) * (point_c[1] - point_a[1]))
+
+
+def downsample_lttb(points, threshold):
+    """
+    Inputs:
+      points    - List of (x, y) tuples sorted by x
+      threshold - Number of points to keep
+
+    Output:
+      Returns a list of at most threshold points from points, chosen
+      with the largest-triangle-three-buckets algorithm so the plotted
+      line keeps its visual shape.  The first and last points are
+      always kept.  If points already fits, or threshold is less than
+      3, a copy of points is returned.
+    """
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / (threshold - 2)
+    previous = points[0]
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        # Average of the next bucket (the last point, for the last bucket)
+        next_bucket = points[end:min(int((bucket + 2) * bucket_size) + 1, len(points))]
+        avg_x = sum(point[0] for point in next_bucket) / len(next_bucket)
+        avg_y = sum(point[1] for point in next_bucket) / len(next_bucket)
+        # Keep the point forming the largest triangle with the previous
+        # kept point and the next bucket's average
+        best_point = points[start]
+        best_area = -1.0
+        for point in points[start:end]:
+            area = triangle_area(previous, point, (avg_x, avg_y))
+            if area > best_area:
+                best_point = point
+                best_area = area
+        previous = best_point
+        sampled.append(previous)
+    sampled.append(points[-1])
+    return sampled
+
+
+def render_xy_values(plot_data, plot_file, max_points=None):
+    """
+    Inputs:
+      plot_data  - Dictionary whose keys are series names and whose
+                   values are lists of XY plot values
+      plot_file  - String that is the output plot file name
+      max_points - If given, reduce each series to at most this many
+                   points with downsample_lttb before plotting
 
     Output:
       Returns None.
 
     Action:
-      Creates an SVG image of an XY plot for the GDP data
-      specified by gdpinfo for the countries in country_list.
-      The image will be stored in a file named by plot_file.
+      Creates an SVG image of an XY plot of plot_data and stores it
+      in a file named by plot_file.
     """
     xy_plot = pygal.XY()
     xy_plot.title = 'Plot of GDP for select countries spanning 1960 to 2015'
     xy_plot.x_title = 'Year'
     xy_plot.y_title = 'GDP in current US dollars'
-    
-    plot_data = build_plot_dict(gdpinfo, country_list)
+
     for c_name, gdp in plot_data.items():
+        if max_points:
+            gdp = downsample_lttb(gdp, max_points)
         xy_plot.add(c_name,gdp)
-        
+
     xy_plot.render_to_file(plot_file)
 
 
+def render_xy_plot(gdpinfo, country_list, plot_file, max_points=None):
+    """
+    Inputs:
+      gdpinfo      - GDP data information dictionary
+      country_list - List of strings that are country names
+      plot_file    - String that is the output plot file name
+      max_points   - If given, plot at most this many points per
+                     country (see downsample_lttb)
+
+    Output:
+      Returns None.
+
+    Action:
+      Creates an SVG image of an XY plot for the GDP data
+      specified by gdpinfo for the countries in country_list.
+      The image will be stored in a file named by plot_file.
+    """
+    plot_data = build_plot_dict(gdpinfo, country_list)
+    render_xy_values(plot_data, plot_file, max_points)
+
+
+def time_render_xy_plot(point_counts=(100, 1000, 10000, 50000), max_points=500):
+    """
+    Time rendering one synthetic series of each length in point_counts,
+    with every point and with the series reduced to max_points, and
+    print the render times and SVG sizes.
+    """
+    with tempfile.TemporaryDirectory() as plot_dir:
+        plot_file = os.path.join(plot_dir, 'plot.svg')
+        for count in point_counts:
+            series = [(step, math.sin(step / 50.0) * 1000 + step) for step in range(count)]
+            for budget in (None, max_points):
+                start = time.perf_counter()
+                render_xy_values({'Series': series}, plot_file, budget)
+                elapsed = time.perf_counter() - start
+                print("{} points, max_points={}: {:.3f}s, {} bytes".format(
+                    count, budget, elapsed, os.path.getsize(plot_file)))
+
+
 def test_render_xy_plot():
     """
     Code to exercise render_xy_plot and generate plots from
@@ -7,10 +7,96 @@ about the expected behavior of the program.
 """
 
 import csv
+import difflib
+import gzip
+import marshal
 import math
+import os
+import re
+import struct
+import time
+import unicodedata
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 import pygal
 
 
+# Set CSV_CACHE to False to always parse the CSV text
+CSV_CACHE = True
+CSV_CACHE_SUFFIX = '.cache'
+CSV_CACHE_MAGIC = b'CSVCACH1'
+CSV_CACHE_HEADER = struct.Struct('<8sQQ')
+
+
+def read_csv_rows_cached(filename, separator, quote):
+    """
+    Inputs:
+      filename  - name of CSV file
+      separator - character that separates fields
+      quote     - character used to optionally quote fields
+    Output:
+      Returns a list of rows, starting with the header row, where
+      each row is a list of field values.  Blank lines are skipped.
+
+      The first call saves the rows to filename + CSV_CACHE_SUFFIX in
+      marshal format.  Later calls load them from there instead of
+      parsing the CSV text, as long as the CSV file's size and
+      modification time have not changed.
+    """
+    stat = os.stat(filename)
+    key = (CSV_CACHE_MAGIC, stat.st_size, stat.st_mtime_ns)
+    cachefile = filename + CSV_CACHE_SUFFIX
+    if CSV_CACHE:
+        try:
+            with open(cachefile, mode='rb') as cache:
+                if CSV_CACHE_HEADER.unpack(cache.read(CSV_CACHE_HEADER.size)) == key:
+                    cached_separator, cached_quote, rows = marshal.loads(cache.read())
+                    if (cached_separator, cached_quote) == (separator, quote):
+                        return rows
+        except (OSError, ValueError, EOFError, TypeError, struct.error):
+            pass
+
+    with open(filename, mode='r', newline='') as csvfile:
+        csvreader = csv.reader(csvfile, delimiter=separator, quotechar=quote)
+        # Share repeated values, so the cache stores each of them once
+        values = dict()
+        rows = [[values.setdefault(value, value) for value in row] for row in csvreader if row]
+    if CSV_CACHE:
+        try:
+            with open(cachefile + '.tmp', mode='wb') as cache:
+                cache.write(CSV_CACHE_HEADER.pack(*key))
+                cache.write(marshal.dumps((separator, quote, rows)))
+            os.replace(cachefile + '.tmp', cachefile)
+        except OSError:
+            pass
+    return rows
+
+
+def csv_rows_as_dicts(rows):
+    """
+    Inputs:
+      rows - list of rows from read_csv_rows_cached
+    Output:
+      Returns a list of dictionaries mapping the field names in the
+      header row to the field values of each following row, exactly
+      as csv.DictReader would.
+    """
+    if not rows:
+        return []
+    fieldnames = rows[0]
+    numfields = len(fieldnames)
+    dicts = []
+    for row in rows[1:]:
+        row_dict = dict(zip(fieldnames, row))
+        if len(row) > numfields:
+            row_dict[None] = row[numfields:]
+        else:
+            for key in fieldnames[len(row):]:
+                row_dict[key] = None
+        dicts.append(row_dict)
+    return dicts
+
+
 # Function from Project from Week 2
 def read_csv_as_nested_dict(filename, keyfield, separator, quote):
     """
@@ -25,11 +111,10 @@ def read_csv_as_nested_dict(filename, keyfield, separator, quote):
       CSV file.  The inner dictionaries map the field names to the
       field values for that row.
     """
+    rows = read_csv_rows_cached(filename, separator, quote)
     row_dict = dict()
-    with open(filename, mode='r', newline='') as csvfile:
-        csvreader = csv.DictReader(csvfile, delimiter=separator, quotechar=quote)
-        for row in csvreader:
-            row_dict[row[keyfield]] = row
+    for row in csv_rows_as_dicts(rows):
+        row_dict[row[keyfield]] = row
     return row_dict
 
 
@@ -61,6 +146,220 @@ def reconcile_countries_by_name(plot_countries, gdp_countries):
     return (output_dict,cc_np)
 
 
+# Abbreviations used in country names, and their expansions
+NAME_ABBREVIATIONS = {'rep': 'republic', 'dem': 'democratic', 'st': 'saint',
+                      'sts': 'states', 'fed': 'federated', 'rb': 'bolivarian republic',
+                      'pdr': 'people democratic republic', 'fyr': 'former yugoslav republic'}
+
+# Words that do not help to tell countries apart
+NAME_STOPWORDS = {'the', 'of', 'and'}
+
+# Names that share no words with the name used for the same country
+# in the GDP data
+NAME_ALIASES = {'Libyan Arab Jamahiriya': 'Libya',
+                'Slovakia': 'Slovak Republic',
+                'Kyrgyzstan': 'Kyrgyz Republic',
+                'Cape Verde': 'Cabo Verde',
+                'Palestine, State of': 'West Bank and Gaza'}
+
+# Matching fuzzy names requires at least this difflib similarity ratio
+FUZZY_NAME_CUTOFF = 0.85
+
+# Name keys, name indexes and fuzzy matches already computed, keyed
+# by the country names they were computed from
+NAME_KEYS = dict()
+NAME_INDEXES = dict()
+FUZZY_NAME_MATCHES = dict()
+
+
+def country_name_words(name):
+    """
+    Inputs:
+      name - Country name
+
+    Output:
+      A list of the words in name, lowercased and without accents or
+      punctuation, with abbreviations expanded.
+    """
+    text = unicodedata.normalize('NFKD', name)
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    text = text.replace("'s", '')
+    words = []
+    for word in re.findall('[a-z0-9]+', text):
+        words.extend(NAME_ABBREVIATIONS.get(word, word).split())
+    return words
+
+
+def country_name_key(name):
+    """
+    Inputs:
+      name - Country name
+
+    Output:
+      A normalized key for name that ignores case, accents,
+      punctuation, word order, abbreviations and known aliases, so
+      "Korea, Rep." and "Korea, Republic of" get the same key.  Keys
+      are computed once per name.
+    """
+    if name not in NAME_KEYS:
+        words = set(country_name_words(NAME_ALIASES.get(name, name))) - NAME_STOPWORDS
+        NAME_KEYS[name] = ' '.join(sorted(words))
+    return NAME_KEYS[name]
+
+
+def build_country_name_index(plot_countries):
+    """
+    Inputs:
+      plot_countries - Dictionary whose keys are plot library country codes
+                       and values are the corresponding country name
+
+    Output:
+      A dictionary mapping the country_name_key of each country name in
+      plot_countries to its plot library country code.  The index is
+      built once per plot_countries and reused.
+    """
+    cache_key = tuple(plot_countries.items())
+    name_index = NAME_INDEXES.get(cache_key)
+    if name_index is None:
+        name_index = {country_name_key(c_name): code for code, c_name in plot_countries.items()}
+        NAME_INDEXES[cache_key] = name_index
+    return name_index
+
+
+def fuzzy_match_names(plot_names, gdp_names):
+    """
+    Inputs:
+      plot_names - Tuple of plot country names that have no exact or
+                   normalized match
+      gdp_names  - Tuple of GDP country names that are not matched yet
+
+    Output:
+      A dictionary mapping names from plot_names to names from
+      gdp_names.  A plot name matches a GDP name when both start with
+      the same word and the words of one contain the words of the
+      other (e.g. "Egypt" and "Egypt, Arab Rep."), as long as there is
+      a single such GDP name.  Otherwise the closest GDP name is used
+      if difflib rates it at least FUZZY_NAME_CUTOFF.  Results are
+      cached for each pair of inputs.
+    """
+    cache_key = (plot_names, gdp_names)
+    if cache_key in FUZZY_NAME_MATCHES:
+        return FUZZY_NAME_MATCHES[cache_key]
+
+    gdp_words = {c_name: country_name_words(c_name) for c_name in gdp_names}
+    compact_names = {''.join(words): c_name for c_name, words in gdp_words.items()}
+    matches = dict()
+    for plot_name in plot_names:
+        words = country_name_words(plot_name)
+        if not words:
+            continue
+        word_set = set(words) - NAME_STOPWORDS
+        candidates = [c_name for c_name, other in gdp_words.items()
+                      if other and other[0] == words[0] and c_name not in matches.values()
+                      and (word_set <= set(other) or set(other) - NAME_STOPWORDS <= word_set)]
+        if len(candidates) == 1:
+            matches[plot_name] = candidates[0]
+            continue
+        close = difflib.get_close_matches(''.join(words), list(compact_names), 1, FUZZY_NAME_CUTOFF)
+        if close and compact_names[close[0]] not in matches.values():
+            matches[plot_name] = compact_names[close[0]]
+    FUZZY_NAME_MATCHES[cache_key] = matches
+    return matches
+
+
+def reconcile_countries_by_name_fuzzy(plot_countries, gdp_countries):
+    """
+    Inputs:
+      plot_countries - Dictionary whose keys are plot library country codes
+                       and values are the corresponding country name
+
+      gdp_countries  - Dictionary whose keys are country names used in GDP data
+
+    Output:
+      Same as reconcile_countries_by_name, but names that differ only
+      in case, accents, punctuation, word order or abbreviations also
+      match (see country_name_key), as do close names found by
+      fuzzy_match_names.  Exact matches always win.
+    """
+    output_dict = dict()
+    name_index = build_country_name_index(plot_countries)
+    unmatched_gdp = []
+    for c_name in gdp_countries:
+        code = name_index.get(country_name_key(c_name))
+        if code is None:
+            unmatched_gdp.append(c_name)
+        elif code not in output_dict or c_name == plot_countries[code]:
+            # An exact name replaces an earlier normalized match
+            if code in output_dict:
+                unmatched_gdp.append(output_dict[code])
+            output_dict[code] = c_name
+        else:
+            unmatched_gdp.append(c_name)
+    unmatched_plot = tuple(plot_countries[code] for code in plot_countries if code not in output_dict)
+    unmatched_gdp = tuple(unmatched_gdp)
+    pc_rev = {c_name: code for code, c_name in plot_countries.items()}
+    for plot_name, c_name in fuzzy_match_names(unmatched_plot, unmatched_gdp).items():
+        output_dict[pc_rev[plot_name]] = c_name
+    cc_np = set(code for code in plot_countries if code not in output_dict)
+    return (output_dict, cc_np)
+
+
+def log_gdp(row, position):
+    """
+    Inputs:
+      row      - List of field values from one row of the GDP file
+      position - Position of a year column in row
+
+    Output:
+      The log (base 10) of the GDP in row[position], or NaN if row is
+      too short to have that column or the value is not a positive
+      number (for example blank or the ".." missing-value marker).
+    """
+    if position >= len(row):
+        return math.nan
+    try:
+        gdp = float(row[position])
+    except ValueError:
+        return math.nan
+    if gdp > 0:
+        return math.log10(gdp)
+    return math.nan
+
+
+def build_gdp_matrix(gdpinfo, keyfield):
+    """
+    Inputs:
+      gdpinfo  - A GDP information dictionary
+      keyfield - Field identifying each country (name or code)
+
+    Output:
+      A tuple containing two dictionaries.  The first maps each value
+      of keyfield to a country position.  The second maps each string
+      year column of the GDP file to an array holding the log (base 10)
+      GDP of every country in that year, indexed by country position.
+      GDP values that are missing, blank, not numbers or not positive
+      are NaN (see log_gdp).
+
+      When a key appears more than once, the last row wins, as in
+      read_csv_as_nested_dict.
+    """
+    rows = read_csv_rows_cached(gdpinfo['gdpfile'], gdpinfo['separator'], gdpinfo['quote'])
+    header = rows[0]
+    key_position = header.index(keyfield)
+    year_positions = [(field, position) for position, field in enumerate(header) if field.isdigit()]
+    country_rows = dict()
+    for row in rows[1:]:
+        if key_position < len(row):
+            country_rows[row[key_position]] = row
+
+    key_index = {key: position for position, key in enumerate(country_rows)}
+    year_columns = dict()
+    for year, position in year_positions:
+        column = array('d', [log_gdp(row, position) for row in country_rows.values()])
+        year_columns[year] = column
+    return (key_index, year_columns)
+
+
 def build_map_dict_by_name(gdpinfo, plot_countries, year):
     """
     Inputs:
@@ -78,21 +377,76 @@ def build_map_dict_by_name(gdpinfo, plot_countries, year):
       codes from plot_countries that were found in the GDP data file, but
       have no GDP data for the specified year.
     """
-    op_dict = dict()
-    set1 = set()
-    set2 = set()
-    nested_dict = read_csv_as_nested_dict(gdpinfo['gdpfile'],
-                                          gdpinfo['country_name'],
-                                          gdpinfo['separator'],
-                                          gdpinfo['quote'])
-    format_dict, format_set = reconcile_countries_by_name(plot_countries, nested_dict)
-    for country_code in format_dict:
-        if nested_dict[format_dict[country_code]][year] == '':
-            set2.add(country_code)
-        else:
-            op_dict[country_code] = math.log10(float(nested_dict[format_dict[country_code]][year]))
-    set1 = format_set
-    return (op_dict,set1,set2)
+    return next(build_map_dicts_by_name(gdpinfo, plot_countries, [year]))
+
+
+def build_map_dicts_by_name(gdpinfo, plot_countries, years, fuzzy=False):
+    """
+    Inputs:
+      gdpinfo        - A GDP information dictionary
+      plot_countries - Dictionary whose keys are plot library country codes
+                       and values are the corresponding country name
+      years          - Sequence of years (strings or integers) to create
+                       GDP mappings for
+      fuzzy          - If True, reconcile country names with
+                       reconcile_countries_by_name_fuzzy
+
+    Output:
+      Generates, for each year in years, the tuple that
+      build_map_dict_by_name returns for that year.  The GDP file is
+      read into a log GDP matrix (see build_gdp_matrix) and the
+      countries are reconciled once, when the first tuple is
+      requested; each year is then a slice of the matrix.
+    """
+    key_index, year_columns = build_gdp_matrix(gdpinfo, gdpinfo['country_name'])
+    if fuzzy:
+        format_dict, format_set = reconcile_countries_by_name_fuzzy(plot_countries, key_index)
+    else:
+        format_dict, format_set = reconcile_countries_by_name(plot_countries, key_index)
+    # Position of each reconciled country in the GDP matrix columns
+    positions = [(country_code, key_index[c_name]) for country_code, c_name in format_dict.items()]
+    for year in years:
+        column = year_columns[str(year)]
+        op_dict = dict()
+        set2 = set()
+        for country_code, position in positions:
+            if math.isnan(column[position]):
+                set2.add(country_code)
+            else:
+                op_dict[country_code] = column[position]
+        yield (op_dict, set(format_set), set2)
+
+
+def render_world_map_values(year, plot_dict, plot_set1, plot_set2, map_file, compress=False):
+    """
+    Inputs:
+      year      - String year of data
+      plot_dict - Dictionary mapping plot library country codes to log GDP
+      plot_set1 - Set of country codes missing from the World Bank data
+      plot_set2 - Set of country codes with no GDP data for the year
+      map_file  - String that is the output map file name
+      compress  - If True, write a gzip-compressed SVG (.svgz) file
+
+    Output:
+      Returns the number of seconds taken to render the map.
+
+    Action:
+      Creates a world map plot of the given values and writes it
+      to a file named by map_file.
+    """
+    start = time.perf_counter()
+    world_map = pygal.maps.world.World()
+    world_map.title = 'GDP by country for '+str(year)+' (log scale), unified by common country NAME'
+    world_map.add('GDP for '+str(year),plot_dict)
+    world_map.add('Missing from World Bank Data',plot_set1)
+    world_map.add('No GDP data',plot_set2)
+    if compress:
+        # The country outlines make up most of the SVG and compress well
+        with gzip.open(map_file, 'wb') as svgz_file:
+            svgz_file.write(world_map.render())
+    else:
+        world_map.render_to_file(map_file)
+    return time.perf_counter() - start
 
 
 def render_world_map(gdpinfo, plot_countries, year, map_file):
@@ -111,13 +465,46 @@ def render_world_map(gdpinfo, plot_countries, year, map_file):
       Creates a world map plot of the GDP data for the given year and
       writes it to a file named by map_file.
     """
-    world_map = pygal.maps.world.World()
     plot_dict, plot_set1, plot_set2 = build_map_dict_by_name(gdpinfo, plot_countries, year)
-    world_map.title = 'GDP by country for '+str(year)+' (log scale), unified by common country NAME'
-    world_map.add('GDP for '+str(year),plot_dict)
-    world_map.add('Missing from World Bank Data',plot_set1)
-    world_map.add('No GDP data',plot_set2)
-    world_map.render_to_file(map_file)
+    render_world_map_values(year, plot_dict, plot_set1, plot_set2, map_file)
+
+
+def render_world_maps(gdpinfo, plot_countries, years, map_prefix, workers=None,
+                      compress=False, fuzzy=False):
+    """
+    Inputs:
+      gdpinfo        - A GDP information dictionary
+      plot_countries - Dictionary whose keys are plot library country codes
+                       and values are the corresponding country name
+      years          - Sequence of years (strings or integers) of data
+      map_prefix     - Start of the output map file names; the map for
+                       each year is written to map_prefix + year + ".svg"
+      workers        - Number of worker processes (defaults to the CPU count)
+      compress       - If True, write gzip-compressed maps to
+                       map_prefix + year + ".svgz" instead
+      fuzzy          - If True, reconcile country names with
+                       reconcile_countries_by_name_fuzzy
+
+    Output:
+      Returns a dictionary mapping each year (as a string) to the
+      number of seconds taken to render its map.
+
+    Action:
+      Computes the GDP values for all years from a single read of the
+      GDP file, then renders the maps in a process pool.  Only the
+      per-year values are sent to the workers.
+    """
+    years = [str(year) for year in years]
+    suffix = '.svgz' if compress else '.svg'
+    map_dicts = build_map_dicts_by_name(gdpinfo, plot_countries, years, fuzzy)
+    if workers == 1:
+        return {year: render_world_map_values(year, *values, map_prefix + year + suffix, compress)
+                for year, values in zip(years, map_dicts)}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {year: pool.submit(render_world_map_values, year, *values,
+                                     map_prefix + year + suffix, compress)
+                   for year, values in zip(years, map_dicts)}
+        return {year: future.result() for year, future in futures.items()}
 
 
 def test_render_world_map():
@@ -151,6 +538,9 @@ def test_render_world_map():
 
 
 # Make sure the following call to test_render_world_map is commented
-# out when submitting to OwlTest/CourseraTest.
+# out when submitting to OwlTest/CourseraTest.  Keep it under the
+# __main__ guard: the worker processes of render_world_maps import
+# this module.
 
-# test_render_world_map()
+# if __name__ == '__main__':
+#     test_render_world_map()
@@ -9,10 +9,93 @@ https://py3.codeskulptor.org/#user304_IMhVMhWtDY_2.py
 """
 
 import csv
+import gzip
+import marshal
 import math
+import os
+import struct
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 import pygal
 
 
+# Set CSV_CACHE to False to always parse the CSV text
+CSV_CACHE = True
+CSV_CACHE_SUFFIX = '.cache'
+CSV_CACHE_MAGIC = b'CSVCACH1'
+CSV_CACHE_HEADER = struct.Struct('<8sQQ')
+
+
+def read_csv_rows_cached(filename, separator, quote):
+    """
+    Inputs:
+      filename  - name of CSV file
+      separator - character that separates fields
+      quote     - character used to optionally quote fields
+    Output:
+      Returns a list of rows, starting with the header row, where
+      each row is a list of field values.  Blank lines are skipped.
+
+      The first call saves the rows to filename + CSV_CACHE_SUFFIX in
+      marshal format.  Later calls load them from there instead of
+      parsing the CSV text, as long as the CSV file's size and
+      modification time have not changed.
+    """
+    stat = os.stat(filename)
+    key = (CSV_CACHE_MAGIC, stat.st_size, stat.st_mtime_ns)
+    cachefile = filename + CSV_CACHE_SUFFIX
+    if CSV_CACHE:
+        try:
+            with open(cachefile, mode='rb') as cache:
+                if CSV_CACHE_HEADER.unpack(cache.read(CSV_CACHE_HEADER.size)) == key:
+                    cached_separator, cached_quote, rows = marshal.loads(cache.read())
+                    if (cached_separator, cached_quote) == (separator, quote):
+                        return rows
+        except (OSError, ValueError, EOFError, TypeError, struct.error):
+            pass
+
+    with open(filename, mode='r', newline='') as csvfile:
+        csv_reader = csv.reader(csvfile, delimiter=separator, quotechar=quote)
+        # Share repeated values, so the cache stores each of them once
+        values = dict()
+        rows = [[values.setdefault(value, value) for value in row] for row in csv_reader if row]
+    if CSV_CACHE:
+        try:
+            with open(cachefile + '.tmp', mode='wb') as cache:
+                cache.write(CSV_CACHE_HEADER.pack(*key))
+                cache.write(marshal.dumps((separator, quote, rows)))
+            os.replace(cachefile + '.tmp', cachefile)
+        except OSError:
+            pass
+    return rows
+
+
+def csv_rows_as_dicts(rows):
+    """
+    Inputs:
+      rows - list of rows from read_csv_rows_cached
+    Output:
+      Returns a list of dictionaries mapping the field names in the
+      header row to the field values of each following row, exactly
+      as csv.DictReader would.
+    """
+    if not rows:
+        return []
+    fieldnames = rows[0]
+    numfields = len(fieldnames)
+    dicts = []
+    for row in rows[1:]:
+        row_dict = dict(zip(fieldnames, row))
+        if len(row) > numfields:
+            row_dict[None] = row[numfields:]
+        else:
+            for key in fieldnames[len(row):]:
+                row_dict[key] = None
+        dicts.append(row_dict)
+    return dicts
+
+
 def build_country_code_converter(codeinfo):
     """
     Inputs:
@@ -29,16 +112,47 @@ def build_country_code_converter(codeinfo):
     keyfield_wbc = codeinfo['data_codes']
     separator = codeinfo['separator']
     quote = codeinfo['quote']
-    with open(filename, mode='r', newline='') as csvfile:
-        csv_reader = csv.DictReader(csvfile,delimiter=separator,quotechar=quote)
-        for row in csv_reader:
-            pc_dict[row[keyfield_pc]] = row
-            wbc_dict[row[keyfield_wbc]] = row
+    rows = read_csv_rows_cached(filename, separator, quote)
+    for row in csv_rows_as_dicts(rows):
+        pc_dict[row[keyfield_pc]] = row
+        wbc_dict[row[keyfield_wbc]] = row
     for pc_dkey, wbc_dkey in zip(pc_dict.keys(), wbc_dict.keys()):
         cc_dict[pc_dkey] = wbc_dkey
     return cc_dict
 
 
+# Converters already built, keyed by the codeinfo fields they depend on
+CODE_CONVERTERS = dict()
+
+def load_country_code_converter(codeinfo):
+    """
+    Inputs:
+      codeinfo      - A country code information dictionary
+
+    Output:
+      A tuple containing the dictionary from build_country_code_converter
+      and a copy of it with lowercase keys and values.
+
+      Both are built once per codeinfo and reused until the size or
+      modification time of the code file changes.
+    """
+    key = tuple(codeinfo[field] for field in
+                ('codefile', 'plot_codes', 'data_codes', 'separator', 'quote'))
+    stat = os.stat(codeinfo['codefile'])
+    version = (stat.st_size, stat.st_mtime_ns)
+    cached = CODE_CONVERTERS.get(key)
+    if cached is None or cached[0] != version:
+        converter_dict = build_country_code_converter(codeinfo)
+        # The key and value country codes in converter dict are not in specific case
+        # Therefore, make a new dict with lowercased key and values
+        lower_converter = dict()
+        for code in converter_dict:
+            lower_converter[code.lower()] = converter_dict[code].lower()
+        cached = (version, converter_dict, lower_converter)
+        CODE_CONVERTERS[key] = cached
+    return (cached[1], cached[2])
+
+
 def reconcile_countries_by_code(codeinfo, plot_countries, gdp_countries):
     """
     Inputs:
@@ -59,15 +173,26 @@ def reconcile_countries_by_code(codeinfo, plot_countries, gdp_countries):
       the codes with the exact same case as they have in
       plot_countries and gdp_countries.
     """
+    lower_converter = load_country_code_converter(codeinfo)[1]
+    return join_codes(lower_converter, plot_countries, gdp_countries)
+
+
+def join_codes(lower_converter, plot_countries, gdp_countries):
+    """
+    Inputs:
+      lower_converter - Dictionary mapping lowercase plot country codes
+                        to lowercase GDP data country codes
+      plot_countries  - Dictionary whose keys are plot library country codes
+      gdp_countries   - Dictionary whose keys are country codes used in GDP data
+
+    Output:
+      Same as reconcile_countries_by_code.  Each plot country code is
+      looked up once in lower_converter and once in a lowercase index
+      of gdp_countries, so the work grows with the number of codes
+      rather than with their product.
+    """
     output_dict = dict()
     output_set = set()
-    
-    converter_dict = build_country_code_converter(codeinfo)
-    # The key and value country codes in converter dict are not in specific case
-    # Therefore, make a new dict with lowercased key and values
-    lower_converter = dict()
-    for key in converter_dict:
-        lower_converter[key.lower()] = converter_dict[key].lower()
 
     # The keys in gdp_countries dictionary are in uppercase
     # But we want all the required country codes in lowercase for comparison
@@ -76,18 +201,70 @@ def reconcile_countries_by_code(codeinfo, plot_countries, gdp_countries):
         lower_gdp[key.lower()] = key
 
     for plot_key in plot_countries:
-        for gdp_key in gdp_countries:
-            if plot_key.lower() in lower_converter:
-                if lower_converter[plot_key.lower()] in lower_gdp:
-                    if lower_converter[plot_key.lower()] == gdp_key.lower():
-                        output_dict[plot_key] = gdp_key
-                elif lower_converter[plot_key.lower()] not in lower_gdp:
-                    output_set.add(plot_key)
-            else:
-                output_set.add(plot_key)
+        gdp_key = lower_gdp.get(lower_converter.get(plot_key.lower()))
+        if gdp_key is None:
+            output_set.add(plot_key)
+        else:
+            output_dict[plot_key] = gdp_key
     return (output_dict, output_set)
 
 
+def log_gdp(row, position):
+    """
+    Inputs:
+      row      - List of field values from one row of the GDP file
+      position - Position of a year column in row
+
+    Output:
+      The log (base 10) of the GDP in row[position], or NaN if row is
+      too short to have that column or the value is not a positive
+      number (for example blank or the ".." missing-value marker).
+    """
+    if position >= len(row):
+        return math.nan
+    try:
+        gdp = float(row[position])
+    except ValueError:
+        return math.nan
+    if gdp > 0:
+        return math.log10(gdp)
+    return math.nan
+
+
+def build_gdp_matrix(gdpinfo, keyfield):
+    """
+    Inputs:
+      gdpinfo  - A GDP information dictionary
+      keyfield - Field identifying each country (name or code)
+
+    Output:
+      A tuple containing two dictionaries.  The first maps each value
+      of keyfield to a country position.  The second maps each string
+      year column of the GDP file to an array holding the log (base 10)
+      GDP of every country in that year, indexed by country position.
+      GDP values that are missing, blank, not numbers or not positive
+      are NaN (see log_gdp).
+
+      When a key appears more than once, the last row wins, as in
+      read_csv_as_nested_dict.
+    """
+    rows = read_csv_rows_cached(gdpinfo['gdpfile'], gdpinfo['separator'], gdpinfo['quote'])
+    header = rows[0]
+    key_position = header.index(keyfield)
+    year_positions = [(field, position) for position, field in enumerate(header) if field.isdigit()]
+    country_rows = dict()
+    for row in rows[1:]:
+        if key_position < len(row):
+            country_rows[row[key_position]] = row
+
+    key_index = {key: position for position, key in enumerate(country_rows)}
+    year_columns = dict()
+    for year, position in year_positions:
+        column = array('d', [log_gdp(row, position) for row in country_rows.values()])
+        year_columns[year] = column
+    return (key_index, year_columns)
+
+
 def build_map_dict_by_code(gdpinfo, codeinfo, plot_countries, year):
     """
     Inputs:
@@ -105,24 +282,72 @@ def build_map_dict_by_code(gdpinfo, codeinfo, plot_countries, year):
       codes from plot_countries that were found in the GDP data file, but
       have no GDP data for the specified year.
     """
-    row_dict = dict()
-    output_dict = dict()
-    set2 = set()
-    with open(gdpinfo['gdpfile'],mode='r',newline='') as csvfile:
-        csv_reader = csv.DictReader(csvfile,
-                                    delimiter = gdpinfo['separator'],
-                                    quotechar = gdpinfo['quote'])
-        for row in csv_reader:
-            row_dict[row[gdpinfo['country_code']]] = dict(row)
-
-    ret_dict, ret_set1 = reconcile_countries_by_code(codeinfo, plot_countries, row_dict)
-    for country_code in ret_dict:
-        if row_dict[ret_dict[country_code]][year] == '':
-            set2.add(country_code)
-        else:
-            gdp = row_dict[ret_dict[country_code]][year]
-            output_dict[country_code] = math.log10(float(gdp))
-    return (output_dict, ret_set1, set2)
+    return next(build_map_dicts_by_code(gdpinfo, codeinfo, plot_countries, [year]))
+
+
+def build_map_dicts_by_code(gdpinfo, codeinfo, plot_countries, years):
+    """
+    Inputs:
+      gdpinfo        - A GDP information dictionary
+      codeinfo       - A country code information dictionary
+      plot_countries - Dictionary mapping plot library country codes to country names
+      years          - Sequence of years (strings or integers) to create
+                       GDP mappings for
+
+    Output:
+      Generates, for each year in years, the tuple that
+      build_map_dict_by_code returns for that year.  The GDP file is
+      read into a log GDP matrix (see build_gdp_matrix) and the
+      countries are reconciled once, when the first tuple is
+      requested; each year is then a slice of the matrix.
+    """
+    key_index, year_columns = build_gdp_matrix(gdpinfo, gdpinfo['country_code'])
+    ret_dict, ret_set1 = reconcile_countries_by_code(codeinfo, plot_countries, key_index)
+    # Position of each reconciled country in the GDP matrix columns
+    positions = [(country_code, key_index[gdp_key]) for country_code, gdp_key in ret_dict.items()]
+    for year in years:
+        column = year_columns[str(year)]
+        output_dict = dict()
+        set2 = set()
+        for country_code, position in positions:
+            if math.isnan(column[position]):
+                set2.add(country_code)
+            else:
+                output_dict[country_code] = column[position]
+        yield (output_dict, set(ret_set1), set2)
+
+
+def render_world_map_values(year, plot_dict, plot_set1, plot_set2, map_file, compress=False):
+    """
+    Inputs:
+      year      - String year of data
+      plot_dict - Dictionary mapping plot library country codes to log GDP
+      plot_set1 - Set of country codes missing from the World Bank data
+      plot_set2 - Set of country codes with no GDP data for the year
+      map_file  - String that is the output map file name
+      compress  - If True, write a gzip-compressed SVG (.svgz) file
+
+    Output:
+      Returns the number of seconds taken to render the map.
+
+    Action:
+      Creates a world map plot of the given values and writes it
+      to a file named by map_file.
+    """
+    start = time.perf_counter()
+    world_map = pygal.maps.world.World()
+    world_map.title = 'GDP by country for '+str(year)+' (log scale), unified by common country CODE'
+    world_map.add('GDP for '+str(year),plot_dict)
+    world_map.add('Missing from World Bank Data',plot_set1)
+    world_map.add('No GDP data',plot_set2)
+    if compress:
+        # The country outlines make up most of the SVG and compress well
+        with gzip.open(map_file, 'wb') as svgz_file:
+            svgz_file.write(world_map.render())
+    else:
+        world_map.render_to_file(map_file)
+    return time.perf_counter() - start
+
 
 def render_world_map(gdpinfo, codeinfo, plot_countries, year, map_file):
     """
@@ -140,13 +365,44 @@ def render_world_map(gdpinfo, codeinfo, plot_countries, year, map_file):
       Creates a world map plot of the GDP data in gdp_mapping and outputs
       it to a file named by svg_filename.
     """
-    world_map = pygal.maps.world.World()
     plot_dict, plot_set1, plot_set2 = build_map_dict_by_code(gdpinfo,codeinfo,plot_countries,year)
-    world_map.title = 'GDP by country for '+str(year)+' (log scale), unified by common country CODE'
-    world_map.add('GDP for '+str(year),plot_dict)
-    world_map.add('Missing from World Bank Data',plot_set1)
-    world_map.add('No GDP data',plot_set2)
-    world_map.render_to_file(map_file)
+    render_world_map_values(year, plot_dict, plot_set1, plot_set2, map_file)
+
+
+def render_world_maps(gdpinfo, codeinfo, plot_countries, years, map_prefix, workers=None,
+                      compress=False):
+    """
+    Inputs:
+      gdpinfo        - A GDP information dictionary
+      codeinfo       - A country code information dictionary
+      plot_countries - Dictionary mapping plot library country codes to country names
+      years          - Sequence of years (strings or integers) of data
+      map_prefix     - Start of the output map file names; the map for
+                       each year is written to map_prefix + year + ".svg"
+      workers        - Number of worker processes (defaults to the CPU count)
+      compress       - If True, write gzip-compressed maps to
+                       map_prefix + year + ".svgz" instead
+
+    Output:
+      Returns a dictionary mapping each year (as a string) to the
+      number of seconds taken to render its map.
+
+    Action:
+      Computes the GDP values for all years from a single read of the
+      GDP file, then renders the maps in a process pool.  Only the
+      per-year values are sent to the workers.
+    """
+    years = [str(year) for year in years]
+    suffix = '.svgz' if compress else '.svg'
+    map_dicts = build_map_dicts_by_code(gdpinfo, codeinfo, plot_countries, years)
+    if workers == 1:
+        return {year: render_world_map_values(year, *values, map_prefix + year + suffix, compress)
+                for year, values in zip(years, map_dicts)}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {year: pool.submit(render_world_map_values, year, *values,
+                                     map_prefix + year + suffix, compress)
+                   for year, values in zip(years, map_dicts)}
+        return {year: future.result() for year, future in futures.items()}
 
 
 def test_render_world_map():
@@ -187,7 +443,54 @@ def test_render_world_map():
     render_world_map(gdpinfo, codeinfo, pygal_countries, "2010", "isp_gdp_world_code_2010.svg")
 
 
+def join_codes_nested(lower_converter, plot_countries, gdp_countries):
+    """
+    The nested loop previously used by reconcile_countries_by_code,
+    kept as a reference for time_join_codes.
+    """
+    output_dict = dict()
+    output_set = set()
+    lower_gdp = dict()
+    for key in gdp_countries:
+        lower_gdp[key.lower()] = key
+    for plot_key in plot_countries:
+        for gdp_key in gdp_countries:
+            if plot_key.lower() in lower_converter:
+                if lower_converter[plot_key.lower()] in lower_gdp:
+                    if lower_converter[plot_key.lower()] == gdp_key.lower():
+                        output_dict[plot_key] = gdp_key
+                elif lower_converter[plot_key.lower()] not in lower_gdp:
+                    output_set.add(plot_key)
+            else:
+                output_set.add(plot_key)
+    return (output_dict, output_set)
+
+
+def time_join_codes(numcodes=10000):
+    """
+    Time join_codes against join_codes_nested on numcodes synthetic
+    plot codes and numcodes synthetic GDP codes.  About a tenth of the
+    plot codes have no converter entry and another tenth have no GDP
+    data.
+    """
+    plot_countries = {'p' + str(code): 'Country ' + str(code) for code in range(numcodes)}
+    lower_converter = {'p' + str(code): 'g' + str(code) for code in range(numcodes)
+                       if code % 10 != 0}
+    gdp_countries = {'G' + str(code): {} for code in range(numcodes) if code % 10 != 1}
+
+    start = time.perf_counter()
+    joined = join_codes(lower_converter, plot_countries, gdp_countries)
+    print("join_codes: {:.4f}s".format(time.perf_counter() - start))
+    start = time.perf_counter()
+    nested = join_codes_nested(lower_converter, plot_countries, gdp_countries)
+    print("join_codes_nested: {:.4f}s".format(time.perf_counter() - start))
+    print("Results match:", joined == nested)
+
+
 # Make sure the following call to test_render_world_map is commented
-# out when submitting to OwlTest/CourseraTest.
+# out when submitting to OwlTest/CourseraTest.  Keep it under the
+# __main__ guard: the worker processes of render_world_maps import
+# this module.
 
-test_render_world_map()
+if __name__ == '__main__':
+    test_render_world_map()